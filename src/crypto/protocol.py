@@ -29,38 +29,88 @@ class ProtocolFrame:
     FRAME_ACK = 2
     FRAME_GOODBYE = 3  # NEW: Active disconnect notification
 
+    # Fixed 15-byte header: total_length, connection_id, stream_id, frame_type
+    HEADER = struct.Struct("!I8sHB")
+    # Same header with the connection_id read as a big-endian integer
+    HEADER_INT = struct.Struct("!IQHB")
+
     @staticmethod
-    def pack_frame(cid: bytes, stream_id: int, frame_type: int, payload: bytes) -> bytes:
+    def pack_frame(cid: bytes, stream_id: int, frame_type: int, payload: bytes,
+                   out: bytearray | None = None) -> bytearray | memoryview:
         """
         Pack a protocol frame.
+
+        The header and payload are written into a single buffer. If `out` is
+        given (and large enough) the frame is written into it and a memoryview
+        of the used part is returned; otherwise a new bytearray is returned.
         """
         if len(cid) != 8:
             raise ValueError("connection_id must be 8 bytes")
 
+        header_len = ProtocolFrame.HEADER.size
+        frame_len = header_len + len(payload)
+        if out is None:
+            buf = bytearray(frame_len)
+        elif len(out) < frame_len:
+            raise ValueError("output buffer too small for frame")
+        else:
+            buf = out
+
         # total_length = 8 (cid) + 2 (stream_id) + 1 (type) + len(payload)
-        total_length = 8 + 2 + 1 + len(payload)
-        header = struct.pack("!I", total_length)  # 4 bytes
-        header += cid  # 8 bytes
-        header += struct.pack("!H", stream_id)  # 2 bytes
-        header += struct.pack("!B", frame_type)  # 1 byte
-        return header + payload
+        ProtocolFrame.HEADER.pack_into(buf, 0, frame_len - 4, cid, stream_id, frame_type)
+        buf[header_len:frame_len] = payload
+        return buf if out is None else memoryview(buf)[:frame_len]
+
+    @staticmethod
+    def pack_goodbye(cid: bytes) -> bytes:
+        """
+        Pack an empty GOODBYE frame (stream 0). Everything except the CID is
+        constant, so it is spliced between the precomputed header pieces.
+        """
+        if len(cid) != 8:
+            raise ValueError("connection_id must be 8 bytes")
+        return _GOODBYE_PREFIX + cid + _GOODBYE_SUFFIX
 
     @staticmethod
-    def unpack_frame(data: bytes) -> tuple:
+    def unpack_frame(data: bytes | memoryview) -> tuple:
         """
         Unpack a protocol frame.
         Returns: (cid, stream_id, frame_type, payload)
+
+        Accepts bytes or a memoryview over a receive buffer. The cid is always
+        returned as bytes (it is used as a dict key); the payload is a slice of
+        the same type as `data`, so a memoryview input is not copied.
         """
         if len(data) < 4:
             raise ValueError("Frame too short (no length field)")
 
-        total_length = struct.unpack("!I", data[0:4])[0]
+        total_length = struct.unpack_from("!I", data, 0)[0]
         if len(data) < 4 + total_length:
             raise ValueError("Incomplete frame")
 
-        cid = data[4:12]
-        stream_id = struct.unpack("!H", data[12:14])[0]
-        frame_type = struct.unpack("!B", data[14:15])[0]
+        cid = bytes(data[4:12])
+        stream_id, frame_type = struct.unpack_from("!HB", data, 12)
         payload = data[15 : 4 + total_length]
 
         return (cid, stream_id, frame_type, payload)
+
+    @staticmethod
+    def unpack_frame_int(data: bytes | memoryview) -> tuple:
+        """
+        Like unpack_frame, but the cid is returned as an int (the receive hot
+        path): one struct call, no bytes object built for the cid.
+        Returns: (cid_int, stream_id, frame_type, payload)
+        """
+        if len(data) < ProtocolFrame.HEADER_INT.size:
+            raise ValueError("Frame too short (incomplete header)")
+
+        total_length, cid_int, stream_id, frame_type = ProtocolFrame.HEADER_INT.unpack_from(data, 0)
+        if len(data) < 4 + total_length:
+            raise ValueError("Incomplete frame")
+
+        return (cid_int, stream_id, frame_type, data[15 : 4 + total_length])
+
+
+# Constant parts of an empty GOODBYE frame: total_length (11) | cid | stream 0, type
+_GOODBYE_PREFIX = struct.pack("!I", 8 + 2 + 1)
+_GOODBYE_SUFFIX = struct.pack("!HB", 0, ProtocolFrame.FRAME_GOODBYE)
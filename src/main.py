@@ -7,9 +7,16 @@ Runs the async messenger and TUI in the current terminal.
 
 import asyncio
 import getpass
+import logging
+import os
 
 from messenger import DNIeMessenger
 
+# Warnings and errors always show; our [DEBUG] output is enabled with DNIE_DEBUG=1
+logging.basicConfig(level=logging.WARNING, format="[%(levelname)s] %(message)s")
+if os.environ.get("DNIE_DEBUG") == "1":
+    logging.getLogger("dnie").setLevel(logging.DEBUG)
+
 
 async def main():
     print("=== DNIe Instant Messenger ===")
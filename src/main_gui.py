@@ -7,10 +7,18 @@ FIXED: Proper window close detection.
 
 import asyncio
 import getpass
-import tkinter as tk
+import logging
+import os
 
 from messenger import DNIeMessenger
 
+logger = logging.getLogger("dnie.main")
+
+# Warnings and errors always show; our [DEBUG] output is enabled with DNIE_DEBUG=1
+logging.basicConfig(level=logging.WARNING, format="[%(levelname)s] %(message)s")
+if os.environ.get("DNIE_DEBUG") == "1":
+    logging.getLogger("dnie").setLevel(logging.DEBUG)
+
 
 async def main():
     print("=== DNIe Instant Messenger (GUI) ===")
@@ -71,23 +79,17 @@ async def run_gui_async(messenger):
         # Run GUI update loop
         gui = messenger.tui
 
-        # FIXED: Check close_requested flag instead of winfo_exists
-        while not gui.close_requested:
-            try:
-                gui.root.update()
-                await asyncio.sleep(0.01)
-            except tk.TclError:
-                # Window destroyed
-                break
-            except Exception as e:
-                print(f"\n[DEBUG] GUI update error: {e}")
-                break
+        # Returns once close_requested is set or the window is destroyed
+        try:
+            await gui.run_async()
+        except Exception as e:
+            logger.debug("GUI update error: %s", e)
 
     except KeyboardInterrupt:
-        print("\n[DEBUG] KeyboardInterrupt recibido")
+        logger.debug("KeyboardInterrupt recibido")
         gui.close_requested = True
     finally:
-        print("\n[DEBUG] Iniciando cierre limpio...")
+        logger.debug("Iniciando cierre limpio...")
 
         # ============================================
         # Send GOODBYE before cleanup
@@ -101,9 +103,9 @@ async def run_gui_async(messenger):
             # Wait max 1 second for GOODBYE to send
             try:
                 await asyncio.wait_for(goodbye_task, timeout=1.0)
-                print("[DEBUG] GOODBYE sent successfully")
+                logger.debug("GOODBYE sent successfully")
             except asyncio.TimeoutError:
-                print("[WARNING] GOODBYE timeout")
+                logger.warning("GOODBYE timeout")
                 goodbye_task.cancel()
                 try:
                     await goodbye_task
@@ -124,26 +126,41 @@ async def run_gui_async(messenger):
             except (asyncio.TimeoutError, asyncio.CancelledError):
                 pass
         except Exception as e:
-            print(f"[DEBUG] Error canceling recv_task: {e}")
+            logger.debug("Error canceling recv_task: %s", e)
+
+        # Cancel pending background work (delayed queue flushes)
+        try:
+            await messenger.cancel_background_tasks()
+        except Exception as e:
+            logger.debug("Error canceling background tasks: %s", e)
+
+        # Persist any chat history still waiting to be written
+        try:
+            await messenger.flush_history()
+        except Exception as e:
+            logger.debug("Error flushing chat history: %s", e)
 
         # Stop discovery
         if messenger.discovery:
             try:
                 await messenger.discovery.stop_advertising()
             except Exception as e:
-                print(f"[DEBUG] Error stopping discovery: {e}")
+                logger.debug("Error stopping discovery: %s", e)
 
         # Stop transport
         try:
             messenger.transport.stop()
         except Exception as e:
-            print(f"[DEBUG] Error stopping transport: {e}")
+            logger.debug("Error stopping transport: %s", e)
+
+        # Stop crypto worker threads
+        messenger._crypto_executor.shutdown(wait=False)
 
         # Close identity
         try:
             messenger.identity.close()
         except Exception as e:
-            print(f"[DEBUG] Error closing identity: {e}")
+            logger.debug("Error closing identity: %s", e)
 
         # Show final statistics
         print(f"\n📊 Sesión finalizada:")
@@ -178,12 +195,11 @@ async def run_gui_async(messenger):
         except:
             pass
 
-        print("[DEBUG] Cierre completado")
+        logger.debug("Cierre completado")
 
         # Wipe all session keys
         for session in messenger.peer_sessions.values():
-            session.send_key = b'\x00' * 32
-            session.recv_key = b'\x00' * 32
+            session.wipe_keys()
         messenger.peer_sessions.clear()
 
         # Clear GUI
@@ -197,5 +213,5 @@ if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("\n[DEBUG] KeyboardInterrupt en main")
+        logger.debug("KeyboardInterrupt en main")
         pass
@@ -1,24 +1,36 @@
 # dnie_im/messenger.py - FIXED: Reliable reconnection handling
 
 import asyncio
+import concurrent.futures
+import logging
 import secrets
-import struct
-from datetime import datetime
-from typing import Tuple
-
-from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+import time
+from typing import Dict, Optional, Tuple
 
 from identity.im_identity import IMIdentity
 from crypto.noise_ik import NoiseIKState
 from crypto.protocol import ProtocolFrame
 from network.transport import UDPTransport
 from network.discovery import ServiceDiscovery
-from session.session import Session, Peer
+from session.session import Session, Peer, PeerState
 from session.contact_book import ContactBook
-from session.chat_history import ChatHistoryManager
+from session.chat_history import ChatHistoryManager, ChatMessage, now_timestamp
 from session.message_queue import MessageQueue
 from ui.tui import ChatTUI
 
+# Bursts of discovery events within this window produce one peer list refresh
+PEER_LIST_REFRESH_DELAY = 0.05
+
+# Payloads at least this large are encrypted/decrypted in a worker thread
+# so a single big frame cannot stall the event loop; smaller ones run inline
+CRYPTO_OFFLOAD_THRESHOLD = 4096
+
+# An INITIATED handshake that has not completed after this many seconds is
+# treated as failed, so the peer can be retried
+HANDSHAKE_TIMEOUT = 30.0
+
+logger = logging.getLogger("dnie.messenger")
+
 
 class DNIeMessenger:
     """High-level orchestrator for the DNIe instant messenger."""
@@ -36,12 +48,32 @@ class DNIeMessenger:
         self.running = False
         self.loop: asyncio.AbstractEventLoop = None
 
-        # Peer-to-session mapping (always uses address:port as key)
+        # Peer-to-session mapping (always keyed by the (address, port) tuple)
         self.peer_sessions = {}
-        # Track online peers (uses peer_id when available, else address:port)
-        self.online_peers = set()
-        # Track handshake state to prevent loops
-        self.handshake_initiated = set()
+        # Handshake/online state per peer, keyed like peer_sessions.
+        # Absent means IDLE; ESTABLISHED peers have an entry in peer_sessions.
+        self.peer_states: Dict[Tuple[str, int], PeerState] = {}
+        # When each INITIATED entry was set (time.monotonic()); see _peer_state
+        self._handshake_started: Dict[Tuple[str, int], float] = {}
+        # Strong references to fire-and-forget tasks (see _start_task)
+        self._bg_tasks = set()
+        # Pending debounced peer list refresh (asyncio.TimerHandle)
+        self._peer_list_refresh = None
+        # Worker threads for AEAD on large payloads (see _aead)
+        self._crypto_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="dnie-crypto"
+        )
+        # Chat history writes are queued and persisted by _history_flusher
+        self._history_queue: asyncio.Queue | None = None
+        self._history_task: asyncio.Task | None = None
+
+        # Inbound frame dispatch: frame_type -> handler(cid, payload, addr)
+        self._frame_handlers = {
+            # The receiver loop passes the CID as an int; only the handshake needs its bytes
+            ProtocolFrame.FRAME_HANDSHAKE: lambda cid, payload, addr: self.handle_handshake(cid.to_bytes(8, "big"), bytes(payload), addr),
+            ProtocolFrame.FRAME_DATA: self.handle_data_frame,
+            ProtocolFrame.FRAME_GOODBYE: lambda cid, payload, addr: self.handle_goodbye(cid, addr),
+        }
 
         # Wire TUI callbacks
         self.tui.message_send_callback = self.on_message_send
@@ -66,6 +98,10 @@ class DNIeMessenger:
         # Encrypted message queue manager
         self.message_queue = MessageQueue(user_id=user_id, certificate=certificate)
 
+        # Background chat history writer
+        self._history_queue = asyncio.Queue()
+        self._history_task = asyncio.create_task(self._history_flusher())
+
         # Pass username to GUI for proper message detection
         if hasattr(self.tui, 'set_username'):
             self.tui.set_username(self.username)
@@ -76,9 +112,9 @@ class DNIeMessenger:
         # Start mDNS discovery & advertising
         self.discovery = ServiceDiscovery(self.identity)
         self.discovery.static_public_key = self.noise.get_static_public()
-        self.discovery.on_peer_discovered_callback = self.on_peer_discovered
-        self.discovery.on_peer_disconnected_callback = self.on_peer_disconnected
-        self.discovery.on_peer_renamed_callback = self.on_peer_renamed
+        self.discovery.on_peer_discovered_callback = self._handle_peer_discovered
+        self.discovery.on_peer_disconnected_callback = self._handle_peer_disconnected
+        self.discovery.on_peer_renamed_callback = self._handle_peer_renamed
         await self.discovery.start_advertising(self.username)
 
         self.tui.append_chat("🔍 Buscando peers en la red local...")
@@ -90,224 +126,258 @@ class DNIeMessenger:
         their_peer_id = peer.peer_id or ""
 
         if not my_peer_id or not their_peer_id:
-            print(f"[DEBUG] No peer IDs, using IP comparison")
+            logger.debug("No peer IDs, using IP comparison")
             return True  # Initiate by default
 
+        # peer_ids are fixed-width lowercase hex, so str order == byte order
         result = my_peer_id < their_peer_id
-        print(f"[DEBUG] Should initiate to {peer.name}? {result} (my_id={my_peer_id[:8]}..., their_id={their_peer_id[:8]}...)")
+        logger.debug("Should initiate to %s? %s (my_id=%s..., their_id=%s...)", peer.name, result, my_peer_id[:8], their_peer_id[:8])
         return result
 
-    # ---------- Discovery callbacks ----------
-    def on_peer_discovered(self, peer: Peer):
-        """Called (in zeroconf thread) when a new peer is discovered."""
-        print(f"[DEBUG] on_peer_discovered called for {peer.name} ({peer.peer_id})")
-        if self.loop:
-            asyncio.run_coroutine_threadsafe(self._handle_peer_discovered(peer), self.loop)
+    # ---------- AEAD ----------
+    async def _aead(self, op, nonce: bytes, data: bytes | memoryview) -> bytes:
+        """
+        Run a ChaCha20Poly1305 encrypt/decrypt bound method on `data`.
+        Large payloads go to the crypto executor (the C code releases the GIL).
+        """
+        if len(data) < CRYPTO_OFFLOAD_THRESHOLD:
+            return op(nonce, data, None)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._crypto_executor, op, nonce, data, None)
+
+    # ---------- Chat history ----------
+    def _record_history(self, peer_id: str, msg_type: str, sender: str, text: str | bytes,
+                        ts: Optional[str] = None):
+        """
+        Queue a chat history entry. The flusher task timestamps and persists it,
+        keeping datetime formatting and disk I/O off the send/receive paths.
+        Pass `ts` when the handler already computed a timestamp for the event.
+        """
+        if self._history_queue is None:
+            self._write_history([(peer_id, msg_type, sender, text, ts)])
+            return
+        self._history_queue.put_nowait((peer_id, msg_type, sender, text, ts))
 
+    def _write_history(self, batch: list):
+        """Persist a batch of queued history entries with a shared timestamp."""
+        if not self.chat_history:
+            return
+        # Timestamps have second resolution, so one per drained batch suffices
+        batch_ts = now_timestamp()
+        for peer_id, msg_type, sender, text, ts in batch:
+            if isinstance(text, bytes):
+                text = text.decode("utf-8", errors="replace")
+            self.chat_history.add_message(peer_id, ChatMessage(ts or batch_ts, sender, text, msg_type))
+
+    def _drain_history_queue(self) -> list:
+        """Pop every entry currently waiting in the history queue."""
+        batch = []
+        while not self._history_queue.empty():
+            batch.append(self._history_queue.get_nowait())
+        return batch
+
+    async def _history_flusher(self):
+        """Background task: persist queued chat history entries in batches."""
+        while True:
+            batch = [await self._history_queue.get()]
+            batch.extend(self._drain_history_queue())
+            try:
+                self._write_history(batch)
+            except Exception as e:
+                logger.error("Failed to write chat history: %s", e)
+
+    async def flush_history(self):
+        """Stop the history flusher and persist anything still queued."""
+        if self._history_task:
+            self._history_task.cancel()
+            try:
+                await self._history_task
+            except asyncio.CancelledError:
+                pass
+            self._history_task = None
+        if self._history_queue is not None:
+            self._write_history(self._drain_history_queue())
+        if self.chat_history:
+            self.chat_history.close()
+
+    # ---------- Discovery callbacks ----------
     async def _handle_peer_discovered(self, peer: Peer):
-        peer_id = peer.peer_id or f"{peer.address}:{peer.port}"
-        peer_key = f"{peer.address}:{peer.port}"
+        """Called (in the event loop) when a new peer is discovered."""
+        peer_key = peer.key
 
-        print(f"[DEBUG] _handle_peer_discovered: {peer.name}")
-        print(f"[DEBUG] - peer_key: {peer_key}")
-        print(f"[DEBUG] - peer_key in handshake_initiated: {peer_key in self.handshake_initiated}")
-        print(f"[DEBUG] - peer_key in peer_sessions: {peer_key in self.peer_sessions}")
+        logger.debug("_handle_peer_discovered: %s", peer.name)
+        logger.debug("- peer_key: %s", peer_key)
+        logger.debug("- peer state: %s", self._peer_state(peer_key))
+        logger.debug("- peer_key in peer_sessions: %s", peer_key in self.peer_sessions)
 
         # ✅ FIX: Update existing session's peer object if it exists
         if peer_key in self.peer_sessions:
             existing_session = self.peer_sessions[peer_key]
             if not existing_session.peer.peer_id and peer.peer_id:
-                print(f"[DEBUG] Updating session peer_id for {peer.name}: {peer.peer_id}")
+                logger.debug("Updating session peer_id for %s: %s", peer.name, peer.peer_id)
                 existing_session.peer.peer_id = peer.peer_id
                 existing_session.peer.name = peer.name
                 existing_session.peer.static_public_key = peer.static_public_key
 
-                # Update online_peers with proper peer_id
-                old_id = f"{peer.address}:{peer.port}"
-                if old_id in self.online_peers:
-                    self.online_peers.discard(old_id)
-                    self.online_peers.add(peer.peer_id)
-                    print(f"[DEBUG] Updated online_peers: {old_id} -> {peer.peer_id}")
-
         # Show discovery notification
         self.tui.append_chat(f"👀 Peer descubierto: {peer.name} ({peer.peer_id})")
         self.update_peer_list()
 
-        needs_handshake = peer_key not in self.handshake_initiated and peer_key not in self.peer_sessions
-        print(f"[DEBUG] - needs_handshake: {needs_handshake}")
+        needs_handshake = self._peer_state(peer_key) is PeerState.IDLE and peer_key not in self.peer_sessions
+        logger.debug("- needs_handshake: %s", needs_handshake)
 
         if needs_handshake:
             # Only initiate handshake if we should (deterministic rule)
             if self.should_initiate_to_peer(peer):
-                print(f"[DEBUG] ✅ We should initiate to {peer.name}, initiating handshake")
+                logger.debug("✅ We should initiate to %s, initiating handshake", peer.name)
                 await self.initiate_handshake(peer)
             else:
-                print(f"[DEBUG] ⏳ They should initiate to us, waiting for handshake from {peer.name}")
+                logger.debug("⏳ They should initiate to us, waiting for handshake from %s", peer.name)
         else:
-            print(f"[DEBUG] ⏭️ Skipping handshake (already done or in progress)")
+            logger.debug("⏭️ Skipping handshake (already done or in progress)")
 
     async def _check_and_send_queued_messages(self, peer: Peer):
         """Check if we have queued messages for this peer and send them."""
         if not self.message_queue:
             return
 
-        peer_id = peer.peer_id or f"{peer.address}:{peer.port}"
-        peer_key = f"{peer.address}:{peer.port}"
+        peer_id = peer.identity
+        peer_key = peer.key
 
         # Check if we have a session
         if peer_key not in self.peer_sessions:
-            print(f"[DEBUG] No session yet for {peer.name}, skipping queue check")
+            logger.debug("No session yet for %s, skipping queue check", peer.name)
             return
 
-        queued_count = self.message_queue.get_queue_count(peer_id)
-        if queued_count > 0:
-            print(f"[DEBUG] Found {queued_count} queued messages for {peer.name}, sending now")
+        # In-memory check; the encrypted queue is only read when it has messages
+        if self.message_queue.has_queued_messages(peer_id):
+            logger.debug("Found queued messages for %s, sending now", peer.name)
             await self._send_queued_messages(peer)
         else:
-            print(f"[DEBUG] No queued messages for {peer.name}")
+            logger.debug("No queued messages for %s", peer.name)
 
     async def _send_queued_messages(self, peer: Peer):
         """Send all queued messages to a peer that just came online."""
         if not self.message_queue:
             return
 
-        peer_id = peer.peer_id or f"{peer.address}:{peer.port}"
+        peer_id = peer.identity
 
         # Get queued messages and clear queue
         queued = self.message_queue.get_queued_messages(peer_id, clear=True)
         if not queued:
-            print(f"[DEBUG] No queued messages for {peer.name}")
+            logger.debug("No queued messages for %s", peer.name)
             return
 
-        print(f"[DEBUG] Attempting to send {len(queued)} queued messages to {peer.name}")
+        logger.debug("Attempting to send %s queued messages to %s", len(queued), peer.name)
 
-        peer_key = f"{peer.address}:{peer.port}"
+        peer_key = peer.key
         session = self.peer_sessions.get(peer_key)
 
         if not session:
-            print(f"[WARNING] No session for {peer.name}, re-queueing messages")
+            logger.warning("No session for %s, re-queueing messages", peer.name)
             self.tui.append_chat(f"⚠️ No se pudo enviar mensajes encolados - sin sesión")
             # Re-queue messages
-            for msg in queued:
-                self.message_queue.enqueue_message(peer_id, msg["text"], msg.get("metadata"))
+            self.message_queue.enqueue_messages(
+                peer_id, [(msg["text"], msg.get("metadata")) for msg in queued]
+            )
             return
 
-        print(f"[DEBUG] Session found for {peer.name}, sending {len(queued)} messages")
+        logger.debug("Session found for %s, sending %s messages", peer.name, len(queued))
 
-        sent_count = 0
+        # Encrypt and frame everything up front (nonces advance in queue order),
+        # then hand all datagrams to the transport at once.
+        frames = []
         for msg in queued:
             try:
-                text = msg["text"]
-
-                # Encrypt and send
-                cipher = ChaCha20Poly1305(session.send_key)
-                nonce = b"\x00" * 4 + struct.pack("Q", session.send_nonce)
-                ciphertext = cipher.encrypt(nonce, text.encode("utf-8"), None)
-                session.send_nonce += 1
-
-                frame = ProtocolFrame.pack_frame(
+                ciphertext = await self._aead(
+                    session.send_cipher.encrypt, session.next_send_nonce(), msg["text"].encode("utf-8")
+                )
+                frames.append(ProtocolFrame.pack_frame(
                     cid=session.connection_id,
                     stream_id=0,
                     frame_type=ProtocolFrame.FRAME_DATA,
                     payload=ciphertext,
-                )
-
-                await self.transport.send_frame(peer.address, peer.port, frame)
-                sent_count += 1
-                print(f"[DEBUG] Queued message {sent_count}/{len(queued)} sent to {peer.name}")
-
-                # Small delay between messages
-                await asyncio.sleep(0.15)
-
+                ))
             except Exception as e:
-                print(f"[ERROR] Error enviando mensaje encolado: {e}")
+                logger.error("Error cifrando mensaje encolado: %s", e)
+
+        # One batched send (a single sendmmsg syscall where supported)
+        sent_count = await self.transport.send_frames_batch(
+            [(peer.address, peer.port, frame) for frame in frames]
+        )
 
         if sent_count > 0:
             self.tui.append_chat(f"✅ {sent_count} mensaje(s) encolado(s) enviado(s) a {peer.name}")
-            print(f"[DEBUG] Successfully sent {sent_count} queued messages")
-
-    def on_peer_disconnected(self, peer: Peer):
-        """Called (in zeroconf thread) when a peer disappears."""
-        print(f"[DEBUG] on_peer_disconnected called for {peer.name} ({peer.peer_id})")
-        if self.loop:
-            asyncio.run_coroutine_threadsafe(self._handle_peer_disconnected(peer), self.loop)
+            logger.debug("Successfully sent %s/%s queued messages", sent_count, len(queued))
 
     async def _handle_peer_disconnected(self, peer: Peer):
-        peer_id = peer.peer_id or f"{peer.address}:{peer.port}"
-        peer_key = f"{peer.address}:{peer.port}"
+        """Called (in the event loop) when a peer disappears."""
+        logger.debug("Peer disconnected: %s (%s)", peer.name, peer.peer_id)
+        peer_id = peer.identity
+        peer_key = peer.key
 
         # Mark peer as offline IMMEDIATELY
-        was_online = peer_id in self.online_peers
-        self.online_peers.discard(peer_id)
-
-        # Also remove address:port version if it exists
-        addr_port_id = f"{peer.address}:{peer.port}"
-        self.online_peers.discard(addr_port_id)
+        # Clearing the state also allows reconnection
+        was_online = self._forget_peer_state(peer_key) is PeerState.ESTABLISHED
 
-        print(f"[DEBUG] Peer {peer.name} marked as OFFLINE. Total online: {len(self.online_peers)}")
+        logger.debug("Peer %s marked as OFFLINE", peer.name)
 
         if not was_online:
-            print(f"[WARNING] Peer {peer.name} wasn't marked as online!")
+            logger.warning("Peer %s wasn't marked as online!", peer.name)
 
-        ts = datetime.now().replace(microsecond=0).isoformat()
         msg_text = f"{peer.name} se ha desconectado"
 
         # Show in both system logs AND current chat
-        self.tui.append_chat(f"⚠️ {msg_text}", msg_type="disconnect")
+        ui_lines = [(f"⚠️ {msg_text}", "disconnect")]
 
         if self.chat_history and peer.peer_id:
-            msg_obj = {
-                "timestamp": ts,
-                "sender": "system",
-                "text": msg_text,
-                "type": "disconnect",
-            }
-            self.chat_history.add_message(peer.peer_id, msg_obj)
-
-        # Remove from peer_sessions mapping and handshake tracking
+            self._record_history(peer.peer_id, "disconnect", "system", msg_text)
+
+        # Remove from peer_sessions mapping
         if peer_key in self.peer_sessions:
             session = self.peer_sessions[peer_key] # Se limpian las claves de sesión antes de cerrar para que no se queden en memoria
             # Wipe keys before deletion
-            session.send_key = b'\x00' * 32
-            session.recv_key = b'\x00' * 32
+            session.wipe_keys()
             del self.peer_sessions[peer_key]
-            del self.peer_sessions[peer_key]
-            print(f"[DEBUG] Removed session for {peer.name}")
-
-        # ✅ FIX: Clear handshake tracking to allow reconnection
-        self.handshake_initiated.discard(peer_key)
-        print(f"[DEBUG] Cleared handshake_initiated for {peer_key}")
+            logger.debug("Removed session for %s", peer.name)
 
         # Check if we're currently chatting with this peer
         current_peer = self.tui.get_current_peer()
         if current_peer and current_peer.peer_id == peer_id:
             # Show additional disconnect notification in current chat
             disconnect_msg = f"⚠️ {peer.name} está desconectado. Los mensajes se guardarán hasta que vuelva."
-            self.tui.append_chat(disconnect_msg, msg_type="disconnect")
+            ui_lines.append((disconnect_msg, "disconnect"))
 
+        self.tui.append_chat_batch(ui_lines)
         self.update_peer_list()
 
-    def on_peer_renamed(self, peer: Peer, old_name: str, new_name: str):
-        """Called (in zeroconf thread) when a peer changes its name."""
-        if self.loop:
-            asyncio.run_coroutine_threadsafe(
-                self._handle_peer_renamed(peer, old_name, new_name), self.loop
-            )
-
     async def _handle_peer_renamed(self, peer: Peer, old_name: str, new_name: str):
-        """Handle peer name change in the main event loop."""
+        """Called (in the event loop) when a peer changes its name."""
         self.tui.append_chat(
             f"📝 {old_name} ha cambiado su nombre a {new_name} (ID: {peer.peer_id})"
         )
         self.update_peer_list()
 
         # Update session peer name if session exists
-        peer_key = f"{peer.address}:{peer.port}"
+        peer_key = peer.key
         if peer_key in self.peer_sessions:
             self.peer_sessions[peer_key].peer.name = new_name
 
     def update_peer_list(self):
+        """Schedule a refresh of the TUI peer list, coalescing bursts of events."""
+        if self._peer_list_refresh is not None:
+            return
+        if not self.loop:
+            self._refresh_peer_list()
+            return
+        self._peer_list_refresh = self.loop.call_later(
+            PEER_LIST_REFRESH_DELAY, self._refresh_peer_list
+        )
+
+    def _refresh_peer_list(self):
         """Push discovered peers into the TUI list."""
+        self._peer_list_refresh = None
         if self.discovery:
             peers = list(self.discovery.discovered_peers.values())
             self.tui.update_contacts(peers)
@@ -320,37 +390,23 @@ class DNIeMessenger:
                 self.tui.append_chat(f"⚠️ No hay clave pública para {peer.name}")
                 return
 
-            peer_key = f"{peer.address}:{peer.port}"
+            peer_key = peer.key
 
             # Check if already initiated or session exists
-            if peer_key in self.handshake_initiated or peer_key in self.peer_sessions:
-                print(f"[DEBUG] Handshake already done with {peer.name}, skipping")
+            if self._peer_state(peer_key) is not PeerState.IDLE or peer_key in self.peer_sessions:
+                logger.debug("Handshake already done with %s, skipping", peer.name)
                 return
 
             # Mark as initiated
-            self.handshake_initiated.add(peer_key)
-            print(f"[DEBUG] Added {peer_key} to handshake_initiated")
+            self.peer_states[peer_key] = PeerState.INITIATED
+            self._handshake_started[peer_key] = time.monotonic()
+            logger.debug("Marked %s as INITIATED", peer_key)
 
             rs_pub_bytes = peer.static_public_key
             msg, k_send, k_recv = self.noise.initiate(rs_pub_bytes)
             cid = secrets.token_bytes(8)
 
-            session = Session(
-                connection_id=cid,
-                peer=peer,
-                send_key=k_send,
-                recv_key=k_recv,
-            )
-            self.transport.register_session(cid, session)
-
-            # Add to peer_sessions mapping
-            self.peer_sessions[peer_key] = session
-
-            # ✅ Mark as online ONLY after session is established
-            peer_id = peer.peer_id or f"{peer.address}:{peer.port}"
-            was_offline = peer_id not in self.online_peers
-            self.online_peers.add(peer_id)
-            print(f"[DEBUG] Peer {peer.name} marked as ONLINE after handshake. Total online: {len(self.online_peers)}")
+            was_offline = self._finalize_handshake(peer, cid, k_send, k_recv, initiator=True)
 
             frame = ProtocolFrame.pack_frame(
                 cid=cid,
@@ -360,82 +416,137 @@ class DNIeMessenger:
             )
 
             await self.transport.send_frame(peer.address, peer.port, frame)
-            print(f"[DEBUG] Handshake INITIATED to {peer.name}")
-            print(f"[DEBUG] CID: {cid.hex()}")
-            print(f"[DEBUG] Peer: {peer.address}:{peer.port}")
+            logger.debug("Handshake INITIATED to %s", peer.name)
+            logger.debug("CID: %s", cid.hex())
+            logger.debug("Peer: %s", peer.label)
 
             if was_offline:
                 self.tui.append_chat(f"✓ Peer conectado: {peer.name}")
 
             self.tui.append_chat(f"🤝 Handshake iniciado con {peer.name}")
 
-            # Check for queued messages after handshake completes
-            await asyncio.sleep(0.5)
-            await self._check_and_send_queued_messages(peer)
+            # Check for queued messages once the responder has had time to
+            # register the session, without holding up this handshake
+            self._start_task(self._delayed_queue_flush(peer))
 
         except Exception as e:
             self.tui.append_chat(f"⚠️ Error iniciando handshake con {peer.name}: {e}")
-            print(f"[ERROR] Handshake initiation failed: {e}")
-            import traceback
-            traceback.print_exc()
-            # Remove from initiated on error
-            peer_key = f"{peer.address}:{peer.port}"
-            self.handshake_initiated.discard(peer_key)
+            logger.exception("Handshake initiation failed for %s", peer.name)
+            # Forget the attempt on error (an already established session is kept)
+            if self.peer_states.get(peer.key) is PeerState.INITIATED:
+                self._forget_peer_state(peer.key)
+
+    def _start_task(self, coro) -> asyncio.Task:
+        """
+        Run `coro` as a tracked fire-and-forget task on the messenger loop.
+        UI callbacks already run on the loop thread (Tk is pumped and
+        prompt_toolkit runs inside it), so no thread-safe handoff is needed.
+        """
+        task = self.loop.create_task(coro)
+        self._bg_tasks.add(task)
+        task.add_done_callback(self._bg_tasks.discard)
+        return task
+
+    async def _delayed_queue_flush(self, peer: Peer):
+        """Background task: send queued messages shortly after initiating a handshake."""
+        await asyncio.sleep(0.5)
+        await self._check_and_send_queued_messages(peer)
+
+    async def cancel_background_tasks(self):
+        """Cancel pending background tasks (sends, queue flushes) at shutdown."""
+        tasks = list(self._bg_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _peer_state(self, peer_key: Tuple[str, int]) -> PeerState:
+        """
+        Current state for a peer. An INITIATED entry older than
+        HANDSHAKE_TIMEOUT is dropped and reported as IDLE, so a handshake that
+        never completed cannot block retries forever.
+        """
+        state = self.peer_states.get(peer_key, PeerState.IDLE)
+        if state is PeerState.INITIATED:
+            started = self._handshake_started.get(peer_key, 0.0)
+            if time.monotonic() - started > HANDSHAKE_TIMEOUT:
+                self._forget_peer_state(peer_key)
+                return PeerState.IDLE
+        return state
+
+    def _forget_peer_state(self, peer_key: Tuple[str, int]) -> Optional[PeerState]:
+        """Reset a peer to IDLE; returns the state it had."""
+        self._handshake_started.pop(peer_key, None)
+        return self.peer_states.pop(peer_key, None)
+
+    def _finalize_handshake(self, peer: Peer, cid: bytes, k_send: bytes, k_recv: bytes,
+                            initiator: bool) -> bool:
+        """
+        Bookkeeping shared by both handshake roles: create and register the
+        session for `cid` (replacing any previous one for this peer) and mark
+        the peer ESTABLISHED. Returns True if the peer was not online before.
+        """
+        peer_key = peer.key
+
+        old_session = self.peer_sessions.get(peer_key)
+        if old_session:
+            logger.debug("Replacing existing session with %s", peer.label)
+            self.transport.unregister_session(old_session.connection_id)
+
+        session = Session(
+            connection_id=cid,
+            peer=peer,
+            send_key=k_send,
+            recv_key=k_recv,
+            initiator=initiator,
+        )
+        self.transport.register_session(cid, session)
+        session.goodbye_frame = ProtocolFrame.pack_goodbye(cid)
+        self.peer_sessions[peer_key] = session
+
+        # ✅ Mark as online ONLY after session is established
+        was_offline = self.peer_states.get(peer_key) is not PeerState.ESTABLISHED
+        self.peer_states[peer_key] = PeerState.ESTABLISHED
+        self._handshake_started.pop(peer_key, None)
+        logger.debug("Peer %s marked as ONLINE after handshake", peer.name)
+        return was_offline
 
     async def handle_handshake(self, cid: bytes, payload: bytes, addr: Tuple[str, int]):
         """Responder side: derive keys from initiator's IK message."""
         try:
-            print(f"[DEBUG] Handshake RECEIVED from {addr[0]}:{addr[1]}")
-            print(f"[DEBUG] CID from initiator: {cid.hex()}")
+            logger.debug("Handshake RECEIVED from %s:%s", addr[0], addr[1])
+            logger.debug("CID from initiator: %s", cid.hex())
 
-            k_send, k_recv = self.noise.respond(payload)
-            print(f"[DEBUG] Noise handshake successful, keys derived")
-
-            # Try to find the peer in discovered_peers
+            # Try to find the peer in discovered_peers. IK sends the initiator's
+            # static key in the clear (e_pub || s_pub), which identifies it even
+            # when several instances share an IP; fall back to the address for
+            # older clients and for peers whose advertised key is stale
             peer = None
             if self.discovery:
-                for p in self.discovery.discovered_peers.values():
-                    if p.address == addr[0]:
-                        peer = p
-                        print(f"[DEBUG] Found peer in discovered_peers: {p.name}")
-                        break
+                peer = (self.discovery.peers_by_static_key.get(payload[32:64])
+                        or self.discovery.peers_by_address.get(addr[0]))
+                if peer:
+                    logger.debug("Found peer in discovered_peers: %s", peer.name)
 
             # If not found, create temporary peer (will be updated when discovered)
             if not peer:
-                print(f"[DEBUG] Peer not in discovered_peers, creating temporary peer")
+                logger.debug("Peer not in discovered_peers, creating temporary peer")
                 peer = Peer(name=f"{addr[0]}", address=addr[0], port=addr[1])
 
-            peer_key = f"{peer.address}:{peer.port}"
-
-            # Always create session for responder side, even if we already have one
-            # (This handles crossing handshakes - we replace our initiated session with theirs)
-            if peer_key in self.peer_sessions:
-                print(f"[DEBUG] Replacing existing session with {peer.address}:{peer.port}")
-                # Unregister old session
-                old_session = self.peer_sessions[peer_key]
-                self.transport.sessions.pop(old_session.connection_id, None)
-
-            # Use the CID from the initiator
-            session = Session(
-                connection_id=cid,
-                peer=peer,
-                send_key=k_send,
-                recv_key=k_recv,
-            )
-            self.transport.register_session(cid, session)
+            # Crossing handshakes: if we already initiated a session and the
+            # deterministic rule says we are the initiator, ours wins
+            existing = self.peer_sessions.get(peer.key)
+            if existing and existing.initiator and self.should_initiate_to_peer(peer):
+                logger.debug("Ignoring crossing handshake from %s (we are the initiator)", peer.name)
+                return
 
-            # Add to peer_sessions mapping
-            self.peer_sessions[peer_key] = session
+            k_send, k_recv = self.noise.respond(payload)
+            logger.debug("Noise handshake successful, keys derived")
 
-            # ✅ Mark as online ONLY after session is established
-            peer_id = peer.peer_id or f"{peer.address}:{peer.port}"
-            was_offline = peer_id not in self.online_peers
-            self.online_peers.add(peer_id)
-            print(f"[DEBUG] Peer {peer.name} marked as ONLINE after handshake. Total online: {len(self.online_peers)}")
+            # Otherwise adopt the initiator's session (and CID), replacing ours
+            was_offline = self._finalize_handshake(peer, cid, k_send, k_recv, initiator=False)
 
-            print(f"[DEBUG] Handshake COMPLETED with {peer.address}:{peer.port}")
-            print(f"[DEBUG] CID registered: {cid.hex()}")
-            print(f"[DEBUG] Peer key: {peer_key}")
+            logger.debug("Handshake COMPLETED with %s", peer.label)
+            logger.debug("CID registered: %s", cid.hex())
 
             if was_offline:
                 self.tui.append_chat(f"✓ Peer conectado: {peer.name}")
@@ -443,18 +554,12 @@ class DNIeMessenger:
             self.tui.append_chat(f"🔐 Handshake completado con {peer.name}")
             self.update_peer_list()
 
-            # Mark as initiated to prevent loops
-            self.handshake_initiated.add(peer_key)
-            print(f"[DEBUG] Added {peer_key} to handshake_initiated (responder)")
-
             # Check for queued messages AFTER session is created
             await self._check_and_send_queued_messages(peer)
 
         except Exception as e:
             self.tui.append_chat(f"⚠️ Handshake error: {e}")
-            print(f"[ERROR] Handshake handling failed: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Handshake handling failed from %s:%s", addr[0], addr[1])
 
     def manual_handshake(self):
         """Triggered from TUI (Ctrl+H) to start handshake with selected peer."""
@@ -469,89 +574,57 @@ class DNIeMessenger:
             self.tui.append_chat("⚠️ No hay event loop disponible.")
             return
 
-        asyncio.run_coroutine_threadsafe(self.initiate_handshake(peer), self.loop)
+        self._start_task(self.initiate_handshake(peer))
 
     # ---------- Send GOODBYE to all peers ----------
     async def send_goodbye_to_all(self):
         """Send GOODBYE frame to all connected peers before shutdown."""
-        print("[DEBUG] Sending GOODBYE to all peers...")
-        goodbye_count = 0
-        goodbye_tasks = []
-
-        for peer_key, session in list(self.peer_sessions.items()):
-            try:
-                frame = ProtocolFrame.pack_frame(
-                    cid=session.connection_id,
-                    stream_id=0,
-                    frame_type=ProtocolFrame.FRAME_GOODBYE,
-                    payload=b'',
-                )
-
-                task = self.transport.send_frame(
-                    session.peer.address,
-                    session.peer.port,
-                    frame,
-                )
-                goodbye_tasks.append(task)
-                goodbye_count += 1
-                print(f"[DEBUG] GOODBYE queued for {session.peer.name}")
-
-            except Exception as e:
-                print(f"[ERROR] Failed to queue GOODBYE for {session.peer.name}: {e}")
-
-        # Send all GOODBYEs in parallel with timeout
-        if goodbye_tasks:
-            try:
-                await asyncio.wait_for(
-                    asyncio.gather(*goodbye_tasks, return_exceptions=True),
-                    timeout=1.0
-                )
-                print(f"[DEBUG] Sent GOODBYE to {goodbye_count} peer(s)")
-            except asyncio.TimeoutError:
-                print(f"[WARNING] GOODBYE timeout - some may not have been sent")
+        logger.debug("Sending GOODBYE to all peers...")
+        # Frames were prebuilt at handshake time; shutdown only has to send them
+        goodbyes = [
+            (session.peer.address, session.peer.port, session.goodbye_frame)
+            for session in list(self.peer_sessions.values())
+            if session.goodbye_frame
+        ]
+
+        # Send all GOODBYEs in one batch
+        if goodbyes:
+            sent = await self.transport.send_frames_batch(goodbyes)
+            logger.debug("Sent GOODBYE to %s/%s peer(s)", sent, len(goodbyes))
 
     # ---------- Handle incoming GOODBYE ----------
-    async def handle_goodbye(self, cid: bytes, addr: Tuple[str, int]):
+    async def handle_goodbye(self, cid: int, addr: Tuple[str, int]):
         """Handle GOODBYE frame from peer (explicit disconnect)."""
-        session = self.transport.get_session(cid)
+        session = self.transport.get_session_fast(cid)
         if not session:
-            print(f"[DEBUG] GOODBYE from unknown session")
+            logger.debug("GOODBYE from unknown session")
             return
 
-        peer_id = session.peer.peer_id or f"{session.peer.address}:{session.peer.port}"
+        peer_id = session.peer.identity
         peer_name = session.peer.name
-        print(f"[DEBUG] GOODBYE received from {peer_name}")
+        logger.debug("GOODBYE received from %s", peer_name)
 
-        # Mark as offline (both peer_id and address:port versions)
-        self.online_peers.discard(peer_id)
-        self.online_peers.discard(f"{session.peer.address}:{session.peer.port}")
+        # Mark as offline (this also clears handshake tracking)
+        self._forget_peer_state(session.peer.key)
 
         # Show notification in chat too
-        self.tui.append_chat(f"👋 {peer_name} ha cerrado la sesión", msg_type="disconnect")
+        ui_lines = [(f"👋 {peer_name} ha cerrado la sesión", "disconnect")]
 
         # Save to history
         if self.chat_history and session.peer.peer_id:
-            msg_obj = {
-                "timestamp": datetime.now().replace(microsecond=0).isoformat(),
-                "sender": "system",
-                "text": f"{peer_name} cerró sesión",
-                "type": "disconnect",
-            }
-            self.chat_history.add_message(session.peer.peer_id, msg_obj)
+            self._record_history(session.peer.peer_id, "disconnect", "system", f"{peer_name} cerró sesión")
 
         # Check if we're chatting with this peer
         current_peer = self.tui.get_current_peer()
         if current_peer and current_peer.peer_id == peer_id:
-            self.tui.append_chat(
+            ui_lines.append((
                 f"⚠️ {peer_name} está desconectado. Los mensajes se guardarán hasta que vuelva.",
-                msg_type="disconnect"
-            )
+                "disconnect"
+            ))
+        self.tui.append_chat_batch(ui_lines)
 
-        # Remove session and handshake tracking
-        peer_key = f"{session.peer.address}:{session.peer.port}"
-        if peer_key in self.peer_sessions:
-            del self.peer_sessions[peer_key]
-        self.handshake_initiated.discard(peer_key)
+        # Remove session
+        self.peer_sessions.pop(session.peer.key, None)
         self.update_peer_list()
 
     # ---------- Sending and receiving data ----------
@@ -568,48 +641,44 @@ class DNIeMessenger:
             )
             return
 
-        peer_id = current_peer.peer_id or f"{current_peer.address}:{current_peer.port}"
-        peer_key = f"{current_peer.address}:{current_peer.port}"
+        peer_id = current_peer.identity
+        peer_key = current_peer.key
 
         # Check if peer is online BEFORE trying to send
-        is_online = peer_id in self.online_peers
+        is_online = self.peer_states.get(peer_key) is PeerState.ESTABLISHED
         has_session = peer_key in self.peer_sessions
 
-        print(f"[DEBUG] Sending message to {current_peer.name}")
-        print(f"[DEBUG] - Peer ID: {peer_id}")
-        print(f"[DEBUG] - Is online: {is_online}")
-        print(f"[DEBUG] - Has session: {has_session}")
+        logger.debug("Sending message to %s", current_peer.name)
+        logger.debug("- Peer ID: %s", peer_id)
+        logger.debug("- Is online: %s", is_online)
+        logger.debug("- Has session: %s", has_session)
 
         # Different UI for online vs offline messages
         if not is_online or not has_session:
             # Peer is offline - queue the message
             # Show with different color
-            self.tui.append_chat(f"[Tú → {current_peer.name}]: {text}", msg_type="queued")
+            ui_lines = [(f"[Tú → {current_peer.name}]: {text}", "queued")]
 
+            # One timestamp for both the queue metadata and the history entry
+            ts = now_timestamp()
             if self.message_queue:
                 self.message_queue.enqueue_message(peer_id, text, {
                     'sender': self.username,
-                    'timestamp': datetime.now().isoformat()
+                    'timestamp': ts
                 })
                 queue_count = self.message_queue.get_queue_count(peer_id)
-                self.tui.append_chat(
-                    f"📬 {current_peer.name} está desconectado. Mensaje encolado (total: {queue_count})"
-                )
-                print(f"[DEBUG] Message queued for {current_peer.name} using ID: {peer_id}")
+                ui_lines.append((
+                    f"📬 {current_peer.name} está desconectado. Mensaje encolado (total: {queue_count})",
+                    "user"
+                ))
+                logger.debug("Message queued for %s using ID: %s", current_peer.name, peer_id)
 
             # Save queued message to history with "queued" type
             if self.chat_history and current_peer.peer_id:
-                msg_obj = {
-                    "timestamp": datetime.now().replace(microsecond=0).isoformat(),
-                    "sender": self.username,
-                    "text": text,
-                    "type": "queued",
-                }
-                self.chat_history.add_message(current_peer.peer_id, msg_obj)
+                self._record_history(current_peer.peer_id, "queued", self.username, text, ts)
             else:
-                self.tui.append_chat(
-                    "⚠️ No hay sesión establecida con este peer."
-                )
+                ui_lines.append(("⚠️ No hay sesión establecida con este peer.", "user"))
+            self.tui.append_chat_batch(ui_lines)
             return
 
         # Peer is online - send immediately
@@ -618,20 +687,11 @@ class DNIeMessenger:
 
         # Save to history
         if self.chat_history and current_peer.peer_id:
-            msg_obj = {
-                "timestamp": datetime.now().replace(microsecond=0).isoformat(),
-                "sender": self.username,
-                "text": text,
-                "type": "user",
-            }
-            self.chat_history.add_message(current_peer.peer_id, msg_obj)
+            self._record_history(current_peer.peer_id, "user", self.username, text)
 
         session = self.peer_sessions[peer_key]
         try:
-            cipher = ChaCha20Poly1305(session.send_key)
-            nonce = b"\x00" * 4 + struct.pack("Q", session.send_nonce)
-            ciphertext = cipher.encrypt(nonce, text.encode("utf-8"), None)
-            session.send_nonce += 1
+            ciphertext = session.send_cipher.encrypt(session.next_send_nonce(), text.encode("utf-8"), None)
 
             frame = ProtocolFrame.pack_frame(
                 cid=session.connection_id,
@@ -640,82 +700,65 @@ class DNIeMessenger:
                 payload=ciphertext,
             )
 
-            print(f"[DEBUG] Sending DATA frame with CID: {session.connection_id.hex()}")
+            logger.debug("Sending DATA frame with CID: %s", session.connection_id.hex())
             if self.loop:
-                asyncio.run_coroutine_threadsafe(
+                self._start_task(
                     self.transport.send_frame(
                         current_peer.address,
                         current_peer.port,
                         frame,
-                    ),
-                    self.loop,
+                    )
                 )
-            print(f"[DEBUG] Message sent to {current_peer.name}")
+            logger.debug("Message sent to %s", current_peer.name)
 
         except Exception as e:
             self.tui.append_chat(f"⚠️ Error enviando mensaje: {e}")
-            print(f"[ERROR] Failed to send message: {e}")
+            logger.error("Failed to send message: %s", e)
 
     async def message_receiver_loop(self):
         """Main loop to receive and process frames."""
         while self.running:
             try:
-                frame_data, (addr, port) = await self.transport.recv_frame()
+                frame_data, (addr, port) = await self.transport.recv_frame_into()
                 if not frame_data:
                     continue
 
-                cid, stream_id, frame_type, payload = ProtocolFrame.unpack_frame(frame_data)
-
-                if frame_type == ProtocolFrame.FRAME_HANDSHAKE:
-                    await self.handle_handshake(cid, payload, (addr, port))
-
-                elif frame_type == ProtocolFrame.FRAME_DATA:
-                    await self.handle_data_frame(cid, payload, (addr, port))
-
-                elif frame_type == ProtocolFrame.FRAME_GOODBYE:
-                    await self.handle_goodbye(cid, (addr, port))
+                # payload is a memoryview into the received datagram (no copy)
+                cid, stream_id, frame_type, payload = ProtocolFrame.unpack_frame_int(frame_data)
 
+                handler = self._frame_handlers.get(frame_type)
+                if handler:
+                    await handler(cid, payload, (addr, port))
                 else:
-                    print(f"[WARNING] Unknown frame type: {frame_type}")
+                    logger.warning("Unknown frame type: %s", frame_type)
 
             except asyncio.CancelledError:
-                print("[DEBUG] Receiver loop cancelled")
+                logger.debug("Receiver loop cancelled")
                 break
-            except Exception as e:
-                print(f"[ERROR] Receiver loop error: {e}")
-                import traceback
-                traceback.print_exc()
+            except Exception:
+                logger.exception("Receiver loop error")
 
-    async def handle_data_frame(self, cid: bytes, payload: bytes, addr: Tuple[str, int]):
+    async def handle_data_frame(self, cid: int, payload: bytes | memoryview, addr: Tuple[str, int]):
         """Decrypt and display a received DATA frame."""
-        session = self.transport.get_session(cid)
+        session = self.transport.get_session_fast(cid)
         if not session:
-            print(f"[WARNING] DATA frame from unknown CID: {cid.hex()}")
+            logger.warning("DATA frame from unknown CID: %016x", cid)
             return
 
         try:
-            cipher = ChaCha20Poly1305(session.recv_key)
-            nonce = b"\x00" * 4 + struct.pack("Q", session.recv_nonce)
-            plaintext = cipher.decrypt(nonce, payload, None)
+            plaintext = await self._aead(session.recv_cipher.decrypt, session.current_recv_nonce(), payload)
             session.recv_nonce += 1
 
-            text = plaintext.decode("utf-8")
             peer_name = session.peer.name
 
-            print(f"[DEBUG] Received message from {peer_name}: {text}")
+            logger.debug("Received message from %s (%s bytes)", peer_name, len(plaintext))
 
-            # Save to chat history
+            # Save to chat history (the flusher decodes and timestamps it)
             if self.chat_history and session.peer.peer_id:
-                msg_obj = {
-                    "timestamp": datetime.now().replace(microsecond=0).isoformat(),
-                    "sender": peer_name,
-                    "text": text,
-                    "type": "peer",
-                }
-                self.chat_history.add_message(session.peer.peer_id, msg_obj)
+                self._record_history(session.peer.peer_id, "peer", peer_name, plaintext)
 
-            # Display in TUI
-            self.tui.append_chat(f"[{peer_name} → Tú]: {text}", msg_type="peer")
+            # Display in TUI (decodes the raw plaintext at draw time)
+            self.tui.append_peer_message(peer_name, plaintext)
 
         except Exception as e:
-            print(f"[ERROR] Failed to decrypt DATA frame: {e}")
+            logger.error("Failed to decrypt DATA frame: %s", e)
@@ -4,22 +4,43 @@
 mDNS / Zeroconf service discovery:
 - Advertises this IM client as _dni-im._udp.local. on UDP/5353
 - Discovers other peers with the same service type
+
+TXT record keys are short (v, id, u, k) with the static key as raw bytes.
+While ADVERTISE_LEGACY_TXT is set the legacy keys (version, peer_id, user,
+base64 static_key) are advertised too, since older clients read only those;
+records from older clients are still understood.
 """
 
+import asyncio
 import socket
 import base64
-from typing import Dict, Callable, Optional
+import time
+from typing import Awaitable, Dict, Callable, List, Optional, Set, Tuple
 
-from zeroconf import ServiceInfo, Zeroconf, ServiceBrowser, ServiceStateChange
-from zeroconf.asyncio import AsyncZeroconf
+from zeroconf import ServiceInfo, Zeroconf, ServiceStateChange
+from zeroconf.asyncio import AsyncZeroconf, AsyncServiceBrowser, AsyncServiceInfo
 
 from session.session import Peer
 
+# Identical (name, state change) events within this window are dropped
+# (multi-homed hosts get one copy per interface)
+EVENT_DEDUP_WINDOW = 2.0
+# Dedup entries older than this are pruned
+EVENT_DEDUP_PRUNE_AFTER = 10.0
+
+# Also advertise the legacy TXT keys so clients predating the short keys can
+# still find us. This doubles the record; turn it off, and delete the legacy
+# block in start_advertising, once every deployed client reads the short keys
+ADVERTISE_LEGACY_TXT = True
+
 
 class ServiceDiscovery:
     """
     Advertises and discovers peers using mDNS on UDP/5353.
     Service type: _dni-im._udp.local.
+
+    Runs entirely on the asyncio event loop: service events are resolved with
+    AsyncServiceInfo and the on_peer_* callbacks are coroutines awaited in place.
     """
 
     def __init__(self, identity, port: int = 443):
@@ -28,36 +49,56 @@ class ServiceDiscovery:
         self.aiozc: Optional[AsyncZeroconf] = None
         self.service_info: Optional[ServiceInfo] = None
         self.discovered_peers: Dict[str, Peer] = {}
-        self.on_peer_discovered_callback: Optional[Callable[[Peer], None]] = None
-        self.on_peer_disconnected_callback: Optional[Callable[[Peer], None]] = None
-        self.on_peer_renamed_callback: Optional[Callable[[Peer, str, str], None]] = None  # NEW: (peer, old_name, new_name)
-        self.browser: Optional[ServiceBrowser] = None
+        # Secondary index: peer_id -> Peer (kept in sync with discovered_peers)
+        self.peers_by_id: Dict[str, Peer] = {}
+        # Secondary index: peer_id -> service names currently mapped to that peer
+        self._services_by_peer_id: Dict[str, Set[str]] = {}
+        # Secondary index: IP address -> first Peer seen on it (inbound handshake lookup)
+        self.peers_by_address: Dict[str, Peer] = {}
+        # Secondary index: raw static public key -> Peer (inbound handshake filtering)
+        self.peers_by_static_key: Dict[bytes, Peer] = {}
+        self.on_peer_discovered_callback: Optional[Callable[[Peer], Awaitable[None]]] = None
+        self.on_peer_disconnected_callback: Optional[Callable[[Peer], Awaitable[None]]] = None
+        self.on_peer_renamed_callback: Optional[Callable[[Peer, str, str], Awaitable[None]]] = None  # NEW: (peer, old_name, new_name)
+        self.browser: Optional[AsyncServiceBrowser] = None
+        # Strong references to in-flight service event tasks
+        self._event_tasks: Set[asyncio.Task] = set()
+        # (service name, state change) -> monotonic time it was last handled
+        self._recent_events: Dict[Tuple[str, ServiceStateChange], float] = {}
+        self._last_event_prune = 0.0
         # FIXED: Store static_key to be set by messenger
         self.static_public_key: Optional[bytes] = None
 
     async def start_advertising(self, username: str):
         """Advertise presence on local network with DNIe identity."""
         self.aiozc = AsyncZeroconf()
-        hostname = socket.gethostname()
-        local_ip = socket.gethostbyname(hostname)
+        local_ips = await self._resolve_local_ips()
 
         # FIXED: Use static_public_key that was set by messenger
         if not self.static_public_key:
             raise ValueError("static_public_key must be set before advertising")
 
-        static_key_b64 = base64.b64encode(self.static_public_key).decode('utf-8')
+        properties = {
+            b"v": b"1",
+            b"id": (self.identity.peer_id or "unknown").encode("utf-8"),
+            b"u": username.encode("utf-8"),
+            b"k": self.static_public_key,
+        }
+        if ADVERTISE_LEGACY_TXT:
+            # Legacy keys for older clients, which read only these
+            properties.update({
+                b"version": b"1.0",
+                b"peer_id": properties[b"id"],
+                b"user": properties[b"u"],
+                b"static_key": base64.b64encode(self.static_public_key),
+            })
 
         self.service_info = ServiceInfo(
             type_="_dni-im._udp.local.",
             name=f"{username}._dni-im._udp.local.",
-            addresses=[socket.inet_aton(local_ip)],
+            addresses=[socket.inet_aton(ip) for ip in local_ips],
             port=self.port,
-            properties={
-                b"version": b"1.0",
-                b"peer_id": (self.identity.peer_id or "unknown").encode("utf-8"),
-                b"user": username.encode("utf-8"),
-                b"static_key": static_key_b64.encode("utf-8"),
-            },
+            properties=properties,
         )
 
         await self.aiozc.async_register_service(self.service_info)
@@ -65,16 +106,29 @@ class ServiceDiscovery:
         # print(f"✅ Anunciando presencia como '{username}' (Peer ID: {self.identity.peer_id})")
 
         # Start browser to discover other peers
-        self.browser = ServiceBrowser(
+        self.browser = AsyncServiceBrowser(
             self.aiozc.zeroconf,
             "_dni-im._udp.local.",
             handlers=[self._on_service_state_change],
         )
 
+    @staticmethod
+    async def _resolve_local_ips() -> List[str]:
+        """
+        IPv4 addresses of this host, resolved without blocking the event loop.
+        Loopback addresses are only used if nothing else is found.
+        """
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(socket.gethostname(), None, family=socket.AF_INET)
+        ips = list(dict.fromkeys(info[4][0] for info in infos))
+        return [ip for ip in ips if not ip.startswith("127.")] or ips[:1]
+
     async def stop_advertising(self):
         """Stop advertising and clean up zeroconf."""
         if self.aiozc and self.service_info:
             try:
+                if self.browser:
+                    await self.browser.async_cancel()
                 await self.aiozc.async_unregister_service(self.service_info)
             finally:
                 await self.aiozc.async_close()
@@ -89,28 +143,71 @@ class ServiceDiscovery:
         name: str,
         state_change: ServiceStateChange,
     ):
-        """Internal callback invoked by Zeroconf for service events."""
+        """Internal callback invoked by AsyncServiceBrowser (on the event loop)."""
+        if self._is_duplicate_event(name, state_change):
+            return
+
+        task = asyncio.ensure_future(
+            self._handle_service_state_change(zeroconf, service_type, name, state_change)
+        )
+        self._event_tasks.add(task)
+        task.add_done_callback(self._event_tasks.discard)
+
+    def _is_duplicate_event(self, name: str, state_change: ServiceStateChange) -> bool:
+        """
+        True if the same event for this service was handled less than
+        EVENT_DEDUP_WINDOW seconds ago. Otherwise record it; an Added/Removed
+        resets the opposite entry so a real flap is never swallowed.
+        """
+        now = time.monotonic()
+        key = (name, state_change)
+        if now - self._recent_events.get(key, float("-inf")) < EVENT_DEDUP_WINDOW:
+            return True
+        self._recent_events[key] = now
+
         if state_change is ServiceStateChange.Added:
-            info = zeroconf.get_service_info(service_type, name)
-            if not info:
-                return
+            self._recent_events.pop((name, ServiceStateChange.Removed), None)
+        elif state_change is ServiceStateChange.Removed:
+            self._recent_events.pop((name, ServiceStateChange.Added), None)
+
+        if now - self._last_event_prune > EVENT_DEDUP_PRUNE_AFTER:
+            self._last_event_prune = now
+            self._recent_events = {
+                k: t for k, t in self._recent_events.items()
+                if now - t < EVENT_DEDUP_PRUNE_AFTER
+            }
+        return False
 
+    async def _handle_service_state_change(
+        self,
+        zeroconf: Zeroconf,
+        service_type: str,
+        name: str,
+        state_change: ServiceStateChange,
+    ):
+        """Resolve and apply a single service event."""
+        if state_change is ServiceStateChange.Added:
             # Ignore our own service
             if self.service_info and name == self.service_info.name:
                 return
 
+            info = AsyncServiceInfo(service_type, name)
+            if not await info.async_request(zeroconf, 3000):
+                return
+
             if not info.addresses:
                 return
 
             address = socket.inet_ntoa(info.addresses[0])
             port = info.port
-            peer_id = info.properties.get(b"peer_id", b"").decode("utf-8")
-            username = info.properties.get(b"user", b"").decode("utf-8")
+            props = info.properties
+            peer_id = (props.get(b"id") or props.get(b"peer_id") or b"").decode("utf-8")
+            username = (props.get(b"u") or props.get(b"user") or b"").decode("utf-8")
 
-            # Extract static public key from TXT record
-            static_key_b64 = info.properties.get(b"static_key", b"").decode("utf-8")
-            static_key = None
-            if static_key_b64:
+            # Extract static public key from TXT record (raw; base64 from older clients)
+            static_key = props.get(b"k") or None
+            static_key_b64 = props.get(b"static_key")
+            if static_key is None and static_key_b64:
                 try:
                     static_key = base64.b64decode(static_key_b64)
                 except Exception as e:
@@ -118,36 +215,38 @@ class ServiceDiscovery:
                     pass
 
             # NEW: Check if peer with same peer_id already exists (name change detection)
-            existing_peer = None
-            for service_name, peer in self.discovered_peers.items():
-                if peer.peer_id == peer_id and peer.peer_id:  # Match by peer_id
-                    existing_peer = peer
-                    break
+            existing_peer = self.peers_by_id.get(peer_id) if peer_id else None
 
             if existing_peer:
+                # The peer restarted with a new static key: re-index it
+                if static_key and existing_peer.static_public_key != static_key:
+                    old_key = existing_peer.static_public_key
+                    if old_key and self.peers_by_static_key.get(old_key) is existing_peer:
+                        del self.peers_by_static_key[old_key]
+                    existing_peer.static_public_key = static_key
+                    self.peers_by_static_key[static_key] = existing_peer
+
                 # Peer already exists - check if name changed
                 if existing_peer.name != username:
                     # Name has changed!
                     old_name = existing_peer.name
                     existing_peer.name = username
 
-                    # Update the dictionary key as well (service name changed)
-                    # Remove old service name entry
-                    for service_name in list(self.discovered_peers.keys()):
-                        if self.discovered_peers[service_name] == existing_peer:
-                            del self.discovered_peers[service_name]
-                            break
-
-                    # Add with new service name
+                    # Update the dictionary key as well (service name changed):
+                    # drop the old service name entries, add the new one
+                    for service_name in self._services_by_peer_id.get(peer_id, ()):
+                        self.discovered_peers.pop(service_name, None)
+                    self._services_by_peer_id[peer_id] = {name}
                     self.discovered_peers[name] = existing_peer
 
                     # Notify about name change
                     if self.on_peer_renamed_callback:
-                        self.on_peer_renamed_callback(existing_peer, old_name, username)
+                        await self.on_peer_renamed_callback(existing_peer, old_name, username)
                 else:
                     # Same peer, same name - just update service name mapping if needed
                     if name not in self.discovered_peers:
                         self.discovered_peers[name] = existing_peer
+                        self._services_by_peer_id.setdefault(peer_id, set()).add(name)
             else:
                 # New peer - add normally
                 peer = Peer(
@@ -158,11 +257,17 @@ class ServiceDiscovery:
                     static_public_key=static_key,
                 )
                 self.discovered_peers[name] = peer
+                if peer_id:
+                    self.peers_by_id[peer_id] = peer
+                    self._services_by_peer_id[peer_id] = {name}
+                self.peers_by_address.setdefault(address, peer)
+                if static_key:
+                    self.peers_by_static_key[static_key] = peer
                 # Commented out to not clutter terminal
                 # print(f"🔍 Peer descubierto: {username} @ {address}:{port} (ID: {peer_id})")
 
                 if self.on_peer_discovered_callback:
-                    self.on_peer_discovered_callback(peer)
+                    await self.on_peer_discovered_callback(peer)
 
         elif state_change is ServiceStateChange.Removed:
             if name in self.discovered_peers:
@@ -171,6 +276,34 @@ class ServiceDiscovery:
                 # print(f"👋 Peer desconectado: {removed_peer.name}")
 
                 if self.on_peer_disconnected_callback:
-                    self.on_peer_disconnected_callback(removed_peer)
+                    await self.on_peer_disconnected_callback(removed_peer)
+
+                # The callback awaited, so another event may have removed it already
+                self.discovered_peers.pop(name, None)
+
+                # Is another service name still mapped to this peer?
+                still_listed = False
+                if removed_peer.peer_id and self.peers_by_id.get(removed_peer.peer_id) is removed_peer:
+                    names = self._services_by_peer_id.get(removed_peer.peer_id)
+                    if names is not None:
+                        names.discard(name)
+                        still_listed = bool(names)
+                        if not names:
+                            del self._services_by_peer_id[removed_peer.peer_id]
 
-                del self.discovered_peers[name]
+                    # Drop the id index entry unless another service name still maps to this peer
+                    if not still_listed:
+                        del self.peers_by_id[removed_peer.peer_id]
+
+                if (removed_peer.static_public_key
+                        and self.peers_by_static_key.get(removed_peer.static_public_key) is removed_peer
+                        and not still_listed):
+                    del self.peers_by_static_key[removed_peer.static_public_key]
+
+                # Repoint the address index at another peer on the same IP, if any
+                if self.peers_by_address.get(removed_peer.address) is removed_peer:
+                    del self.peers_by_address[removed_peer.address]
+                    for p in self.discovered_peers.values():
+                        if p.address == removed_peer.address:
+                            self.peers_by_address[p.address] = p
+                            break
@@ -4,14 +4,101 @@
 UDP transport layer:
 - Single UDP socket bound on port 443
 - Multiplexes all sessions with 8-byte Connection IDs (CID)
+- Datagrams are read by asyncio's datagram transport and handed over
+  through a queue; sends go straight to transport.sendto
 """
 
 import socket
 import asyncio
-from typing import Dict, Tuple, Optional
+import ctypes
+import ctypes.util
+import logging
+import struct
+import sys
+from typing import Dict, List, Tuple, Optional
 
 from session.session import Session
 
+logger = logging.getLogger("dnie.transport")
+
+# Kernel socket buffers; larger than the default so bursts are not dropped
+SOCKET_BUFFER_SIZE = 2 * 1024 * 1024
+
+# Received datagrams waiting to be processed; beyond this they are dropped,
+# as the kernel buffer would, so a flood can't grow memory without bound
+RECV_QUEUE_SIZE = 4096
+
+
+# ---------- sendmmsg(2) (Linux): many datagrams in one syscall ----------
+
+def _frame_buffer(frame) -> ctypes.Array:
+    """ctypes view of a frame: shares writable buffers (bytearray), copies bytes once."""
+    try:
+        return (ctypes.c_char * len(frame)).from_buffer(frame)
+    except (TypeError, ValueError):
+        return (ctypes.c_char * len(frame)).from_buffer_copy(frame)
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_sendmmsg():
+    """Return libc's sendmmsg, or None where it is unavailable."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fn = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    fn.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    fn.restype = ctypes.c_int
+    return fn
+
+
+_sendmmsg = _load_sendmmsg()
+
+
+def _sockaddr_in(host: str, port: int) -> bytes:
+    """struct sockaddr_in for an IPv4 (host, port)."""
+    return struct.pack("=H", socket.AF_INET) + struct.pack("!H", port) + socket.inet_aton(host) + bytes(8)
+
+
+class _DatagramReceiver(asyncio.DatagramProtocol):
+    """Pushes received datagrams onto the transport's receive queue (dropped when full)."""
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        try:
+            self.queue.put_nowait((data, addr))
+        except asyncio.QueueFull:
+            logger.debug("Receive queue full, dropping datagram from %s:%s", addr[0], addr[1])
+
+    def error_received(self, exc: Exception):
+        # ICMP errors (e.g. port unreachable from a peer that went away)
+        # are reported here; they must not stop the endpoint. Logged, not
+        # printed, so they don't draw over the TUI.
+        logger.debug("UDP error: %s", exc)
+
 
 class UDPTransport:
     """Manages UDP socket and maps Connection IDs to Session objects."""
@@ -20,48 +107,130 @@ class UDPTransport:
         self.port = port
         self.socket: Optional[socket.socket] = None
         self.sessions: Dict[bytes, Session] = {}
+        # Same sessions keyed by the CID as an int, for the receive hot path
+        self._sessions_by_int: Dict[int, Session] = {}
         self.running: bool = False
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._recv_queue: Optional[asyncio.Queue] = None
 
     async def start(self):
-        """Create and bind the UDP socket, set non-blocking mode."""
-        loop = asyncio.get_event_loop()
+        """Bind the UDP socket and attach it to an asyncio datagram endpoint."""
+        loop = asyncio.get_running_loop()
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                self.socket.setsockopt(socket.SOL_SOCKET, opt, SOCKET_BUFFER_SIZE)
+            except OSError:
+                pass  # The OS may cap or refuse it; the default still works
         self.socket.bind(("0.0.0.0", self.port))
         self.socket.setblocking(False)
+
+        self._recv_queue = asyncio.Queue(maxsize=RECV_QUEUE_SIZE)
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _DatagramReceiver(self._recv_queue),
+            sock=self.socket,
+        )
         self.running = True
         print(f"✅ UDP transport listening on port {self.port}")
 
     # FIXED: Changed signature to accept host and port separately
     async def send_frame(self, host: str, port: int, frame: bytes):
         """Send a raw frame to the given (ip, port)."""
-        if not self.socket:
+        if not self._transport:
             return
-        loop = asyncio.get_event_loop()
-        await loop.sock_sendto(self.socket, frame, (host, port))
+        # sendto never blocks: it sends now or buffers in the transport
+        self._transport.sendto(frame, (host, port))
 
     async def recv_frame(self) -> Tuple[bytes, Tuple[str, int]]:
         """
         Receive a raw datagram from the network.
         Returns (data, (ip, port)).
         """
-        if not self.socket:
+        if not self._recv_queue:
             raise RuntimeError("Socket not started")
-        loop = asyncio.get_event_loop()
-        data, addr = await loop.sock_recvfrom(self.socket, 65536)
-        return data, addr
+        return await self._recv_queue.get()
+
+    async def recv_frame_into(self) -> Tuple[memoryview, Tuple[str, int]]:
+        """
+        Receive a datagram as a zero-copy view.
+        Returns (view, (ip, port)) where view is a memoryview over the
+        received bytes, so slicing the frame apart copies nothing.
+        """
+        data, addr = await self.recv_frame()
+        return memoryview(data), addr
+
+    async def send_frames_batch(self, frames: List[Tuple[str, int, bytes]]) -> int:
+        """
+        Send several (host, port, frame) datagrams, in order.
+        On Linux they go out with a single sendmmsg call; elsewhere, or for
+        whatever sendmmsg could not take, each falls back to sendto.
+        Returns the number of frames handed to the OS or the transport.
+        """
+        if not self._transport or not frames:
+            return 0
+
+        sent = 0
+        # Only bypass the transport when it has nothing buffered (keeps ordering)
+        if _sendmmsg and len(frames) > 1 and self._transport.get_write_buffer_size() == 0:
+            sent = self._sendmmsg(frames)
+
+        for host, port, frame in frames[sent:]:
+            try:
+                self._transport.sendto(frame, (host, port))
+                sent += 1
+            except (OSError, ValueError) as e:
+                logger.warning("Error sending to %s:%s: %s", host, port, e)
+        return sent
+
+    def _sendmmsg(self, frames: List[Tuple[str, int, bytes]]) -> int:
+        """Send frames via sendmmsg; returns how many the kernel accepted (0 on error)."""
+        n = len(frames)
+        msgs = (_MMsgHdr * n)()
+        iovs = (_IOVec * n)()
+        keep = []  # Buffers must outlive the syscall
+        try:
+            for i, (host, port, frame) in enumerate(frames):
+                data = _frame_buffer(frame)
+                name = ctypes.create_string_buffer(_sockaddr_in(host, port), 16)
+                keep.append((data, name))
+                iovs[i].iov_base = ctypes.addressof(data)
+                iovs[i].iov_len = len(frame)
+                hdr = msgs[i].msg_hdr
+                hdr.msg_name = ctypes.addressof(name)
+                hdr.msg_namelen = 16
+                hdr.msg_iov = ctypes.pointer(iovs[i])
+                hdr.msg_iovlen = 1
+        except OSError:
+            return 0  # e.g. a hostname instead of an IPv4 literal
+
+        result = _sendmmsg(self.socket.fileno(), msgs, n, 0)
+        return max(result, 0)
 
     def register_session(self, cid: bytes, session: Session):
         """Register a new session under a given CID."""
         self.sessions[cid] = session
+        self._sessions_by_int[int.from_bytes(cid, "big")] = session
+
+    def unregister_session(self, cid: bytes):
+        """Forget the session registered under a CID, if any."""
+        self.sessions.pop(cid, None)
+        self._sessions_by_int.pop(int.from_bytes(cid, "big"), None)
 
     def get_session(self, cid: bytes) -> Optional[Session]:
         """Look up a Session by CID."""
         return self.sessions.get(cid)
 
+    def get_session_fast(self, cid_int: int) -> Optional[Session]:
+        """Look up a Session by CID given as an int (see ProtocolFrame.unpack_frame_int)."""
+        return self._sessions_by_int.get(cid_int)
+
     def stop(self):
-        """Close the UDP socket."""
+        """Close the datagram endpoint and its UDP socket."""
         self.running = False
-        if self.socket:
+        if self._transport:
+            self._transport.close()
+            self._transport = None
+        elif self.socket:
             self.socket.close()
-            self.socket = None
+        self.socket = None
@@ -1,7 +1,7 @@
 # dnie_im/session/__init__.py
 
-from .session import Session, Peer
+from .session import Session, Peer, PeerState
 from .contact_book import ContactBook
-from .chat_history import ChatHistoryManager
+from .chat_history import ChatHistoryManager, ChatMessage
 
-__all__ = ['Session', 'Peer', 'ContactBook', 'ChatHistoryManager']
+__all__ = ['Session', 'Peer', 'PeerState', 'ContactBook', 'ChatHistoryManager', 'ChatMessage']
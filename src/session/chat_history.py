@@ -1,24 +1,141 @@
 # dnie_im/session/chat_history.py
 
 """
-Encrypted chat history manager using Fernet encryption.
+Encrypted chat history manager using AES-256-GCM (Fernet for older data).
 Similar approach to the password manager - derives key from DNIe certificate.
 Each user has their own encrypted chat history directory.
+
+On-disk format (per peer): LOG_MAGIC followed by length-prefixed records,
+each record one encrypted JSON object. The first record is a header
+({'peer_id', 'created'}); every following record is one message. Appending a
+message encrypts and writes only that message. Every COMPACT_EVERY appended
+messages the file is compacted: rewritten with the messages grouped into
+chunk records of up to COMPACT_EVERY messages each, so loading a long
+history takes one decrypt per chunk instead of one per message. Files written by older
+versions (a single Fernet token of the whole history) are still read and are
+converted to the log format on the next write.
+
+An encrypted sidecar (INDEX_FILE) keeps each file's peer_id, message count
+and last activity, so listing recent peers and statistics read no chat files.
+It is written lazily; an entry whose recorded file size no longer matches
+the file (e.g. after a crash) is rebuilt from the file on load.
+
+Every encrypted blob (record, legacy file, index) starts with a format byte:
+AEAD_VERSION blobs are nonce + AES-GCM ciphertext; anything else is a Fernet
+token written by an older version, which is still decrypted with the same key.
 """
 
 import os
-import json
+import atexit
+import struct
+import threading
+import time
 import hashlib
 import base64
+import functools
+import mmap
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from session.jsonutil import dumps as _dumps, loads as _loads
+
+# (epoch second, its ISO string) for now_timestamp()
+_ts_cache: Tuple[int, str] = (-1, "")
+
+
+def now_timestamp() -> str:
+    """
+    Current local time as a second-resolution ISO 8601 string. The string
+    is only formatted again when the second changes.
+    """
+    global _ts_cache
+    sec = int(time.time())
+    if sec != _ts_cache[0]:
+        _ts_cache = (sec, datetime.fromtimestamp(sec).isoformat())
+    return _ts_cache[1]
+
+
+@functools.lru_cache(maxsize=1024)
+def _safe_name(value: str) -> str:
+    """Filename-safe 16-hex-digit hash of a user or peer id (memoized)."""
+    return hashlib.sha256(value.encode()).hexdigest()[:16]
+
+# Leading byte of AES-GCM blobs (Fernet tokens are base64 text starting with b'g')
+AEAD_VERSION = b"\x02"
+AEAD_NONCE_SIZE = 12
+
+# Derived keys by sha256(certificate || salt), so re-creating a manager for
+# the same certificate skips the 100k-iteration PBKDF2
+_KEY_SALT = b'dnie_chat_history_salt'  # Different salt than password manager
+_KEY_CACHE: Dict[bytes, bytes] = {}
+_KEY_CACHE_LOCK = threading.Lock()
+
+# Marks a chat file in the append-only log format
+LOG_MAGIC = b"DNIECHAT1\n"
+# Big-endian length prefix of each record
+_RECORD_LEN = struct.Struct(">I")
+# Length prefix bit marking a chunk record (a JSON list of messages); the
+# prefix is then followed by the chunk's message count, before the token
+_CHUNK_FLAG = 0x80000000
+_CHUNK_COUNT = struct.Struct(">H")
+
+# Appended single-message records that trigger a compaction; also the chunk size
+COMPACT_EVERY = 128
+
+# Number of peers whose decrypted history is kept in memory
+HISTORY_CACHE_SIZE = 32
+
+# Upper bound on threads used to read/decrypt several chat files at once
+SCAN_WORKERS = 8
+
+# Encrypted sidecar: chat filename -> {'peer_id', 'count', 'tail', 'mtime', 'size'}
+INDEX_FILE = "index.enc"
+# Appends only update the index in memory; it is written on compaction,
+# close(), or when an append finds it unsaved for this many seconds
+INDEX_SAVE_INTERVAL = 30.0
+
+
+@dataclass(slots=True)
+class ChatMessage:
+    """
+    A single chat history entry.
+    Slotted to keep per-message memory small; converted to a plain dict
+    only when it is written to disk.
+    """
+    timestamp: Optional[str]
+    sender: str
+    text: str
+    type: str
+
+    def to_dict(self) -> Dict:
+        """Return the on-disk dict representation."""
+        return {
+            'timestamp': self.timestamp,
+            'sender': self.sender,
+            'text': self.text,
+            'type': self.type,
+        }
+
+
+def _locked(method):
+    """Run a ChatHistoryManager method while holding the manager's lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
 
 class ChatHistoryManager:
     """
-    Manages encrypted chat history using Fernet encryption.
+    Manages encrypted chat history using AES-256-GCM.
     Each peer's chat is stored in a separate encrypted file.
     """
 
@@ -33,26 +150,66 @@ class ChatHistoryManager:
         self.user_id = user_id
         self.certificate = certificate
 
-        # Derive Fernet key from certificate (same method as password manager)
-        self.fernet_key = self._derive_key_from_certificate(certificate)
-        self.fernet = Fernet(self.fernet_key)
+        # Derive key from certificate (same method as password manager).
+        # AES-GCM encrypts everything new; Fernet only reads older data.
+        self.key = self._derive_key_from_certificate(certificate)
+        self.aead = AESGCM(self.key)
+        self.fernet = Fernet(base64.urlsafe_b64encode(self.key))
 
         # Setup chat history directory
         self._setup_directories()
 
+        # Serializes the public methods: the GUI reads histories from a worker
+        # thread while the messenger appends from the event loop
+        self._lock = threading.RLock()
+
+        # Decrypted histories: peer_id -> ((st_mtime_ns, st_size), messages).
+        # An entry is only used while the file's stat token still matches.
+        self._hist_cache: "OrderedDict[str, Tuple[Tuple[int, int], List[Dict]]]" = OrderedDict()
+
+        # Per-file bookkeeping so recent peers / statistics need no chat file reads
+        self._index_path = os.path.join(self.user_dir, INDEX_FILE)
+        self._index_dirty = False
+        self._index_saved_at = time.monotonic()
+        self._index: Dict[str, Dict] = self._load_index()
+
+        # Long-lived O_APPEND descriptors for add_message, by file path;
+        # synced every COMPACT_EVERY appends and on close()
+        self._append_fds: Dict[str, int] = {}
+        self._appends_since_sync = 0
+        atexit.register(self.close)
+
     def _derive_key_from_certificate(self, certificate: bytes) -> bytes:
         """
-        Derive Fernet encryption key from DNIe certificate.
-        Uses PBKDF2 with SHA256 (same as password manager).
+        Derive the raw 32-byte encryption key from DNIe certificate.
+        Uses PBKDF2 with SHA256 (same as password manager), once per process
+        for a given certificate.
         """
-        derived = hashlib.pbkdf2_hmac(
-            'sha256',
-            certificate,
-            b'dnie_chat_history_salt',  # Different salt than password manager
-            100000,  # 100k iterations
-            32  # 32 bytes
-        )
-        return base64.urlsafe_b64encode(derived)
+        tag = hashlib.sha256(certificate + _KEY_SALT).digest()
+        with _KEY_CACHE_LOCK:
+            key = _KEY_CACHE.get(tag)
+            if key is None:
+                key = hashlib.pbkdf2_hmac(
+                    'sha256',
+                    certificate,
+                    _KEY_SALT,
+                    100000,  # 100k iterations
+                    32  # 32 bytes
+                )
+                _KEY_CACHE[tag] = key
+        return key
+
+    def _encrypt(self, plaintext: bytes) -> bytes:
+        """Encrypt with AES-256-GCM: AEAD_VERSION + nonce + ciphertext/tag."""
+        nonce = os.urandom(AEAD_NONCE_SIZE)
+        return AEAD_VERSION + nonce + self.aead.encrypt(nonce, plaintext, None)
+
+    def _decrypt(self, blob: bytes) -> bytes:
+        """Decrypt an AES-GCM blob, or a Fernet token from an older version."""
+        if blob[:1] == AEAD_VERSION:
+            nonce_end = 1 + AEAD_NONCE_SIZE
+            return self.aead.decrypt(blob[1:nonce_end], blob[nonce_end:], None)
+        return self.fernet.decrypt(bytes(blob))
 
     def _setup_directories(self):
         """Create chat history directory structure."""
@@ -65,88 +222,464 @@ class ChatHistoryManager:
         os.makedirs(self.base_dir, exist_ok=True)
 
         # Create user-specific directory (based on user_id hash)
-        user_hash = hashlib.sha256(self.user_id.encode()).hexdigest()[:16]
+        user_hash = _safe_name(self.user_id)
         self.user_dir = os.path.join(self.base_dir, f"user_{user_hash}")
         os.makedirs(self.user_dir, exist_ok=True)
 
+    def _chat_files(self) -> Dict[str, os.DirEntry]:
+        """All chat files in the user directory, by name (one scandir pass)."""
+        with os.scandir(self.user_dir) as it:
+            return {e.name: e for e in it
+                    if e.name.startswith('chat_') and e.name.endswith('.enc')}
+
     def _get_peer_file(self, peer_id: str) -> str:
         """Get encrypted file path for a specific peer."""
         # Sanitize peer_id for filename
-        safe_peer_id = hashlib.sha256(peer_id.encode()).hexdigest()[:16]
+        safe_peer_id = _safe_name(peer_id)
         return os.path.join(self.user_dir, f"chat_{safe_peer_id}.enc")
 
+    # ---------- Record log ----------
+
+    def _encode_record(self, obj: Dict) -> bytes:
+        """Encrypt one JSON object into a length-prefixed record."""
+        token = self._encrypt(_dumps(obj))
+        return _RECORD_LEN.pack(len(token)) + token
+
+    def _encode_chunk(self, messages: List[Dict]) -> bytes:
+        """Encrypt a list of messages into one length-prefixed chunk record."""
+        token = self._encrypt(_dumps(messages))
+        return _RECORD_LEN.pack(len(token) | _CHUNK_FLAG) + _CHUNK_COUNT.pack(len(messages)) + token
+
+    @staticmethod
+    @contextmanager
+    def _mapped(file_path: str) -> Iterator[memoryview]:
+        """
+        Read-only memory map of a file, as a memoryview (empty for an empty
+        file). Views sliced from it must not outlive the with block.
+        """
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield memoryview(b"")
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with memoryview(mm) as view:
+                yield view
+        finally:
+            try:
+                mm.close()
+            except BufferError:
+                # A slice is still referenced (e.g. by the traceback of an
+                # exception leaving the block): don't mask that exception,
+                # the map is released with the last reference
+                pass
+
+    @staticmethod
+    def _iter_tokens(data: Union[bytes, memoryview]) -> Iterator[Tuple[Optional[int], memoryview]]:
+        """
+        Yield (chunk_count, token) for each encrypted record of a log-format
+        file's contents; chunk_count is None for single-object records.
+        Tokens are zero-copy slices of `data`.
+        A truncated trailing record (e.g. interrupted write) is ignored.
+        """
+        offset = len(LOG_MAGIC)
+        end = len(data)
+        while offset + _RECORD_LEN.size <= end:
+            (length,) = _RECORD_LEN.unpack_from(data, offset)
+            offset += _RECORD_LEN.size
+            chunk_count = None
+            if length & _CHUNK_FLAG:
+                length &= ~_CHUNK_FLAG
+                if offset + _CHUNK_COUNT.size > end:
+                    break
+                (chunk_count,) = _CHUNK_COUNT.unpack_from(data, offset)
+                offset += _CHUNK_COUNT.size
+            if offset + length > end:
+                break
+            yield chunk_count, data[offset:offset + length]
+            offset += length
+
+    def _decode_records(self, data: memoryview, skip_bad: bool) -> Tuple[List[Tuple[Optional[int], object]], int]:
+        """
+        Decrypt every record of a log-format file's contents.
+        Returns ([(chunk_count, record)], number of unreadable records
+        skipped); a skipped record is kept in place with record None, so
+        positions still tell the header apart. With skip_bad=False the
+        first unreadable record raises.
+        (Own frame: no token slice outlives the mapping.)
+        """
+        records = []
+        skipped = 0
+        for chunk_count, token in self._iter_tokens(data):
+            try:
+                records.append((chunk_count, _loads(self._decrypt(token))))
+            except Exception:
+                if not skip_bad:
+                    raise
+                records.append((chunk_count, None))
+                skipped += 1
+        return records, skipped
+
+    def _read_file(self, file_path: str, skip_bad: bool = True) -> Tuple[Optional[Dict], List[Dict]]:
+        """
+        Read and decrypt a chat file of either format.
+        Returns (header, messages); header is None if the file has no header.
+        Records that fail to decrypt are skipped (and reported), unless
+        skip_bad is False, in which case the error is raised.
+        """
+        # Records are decrypted straight out of the mapping; only each
+        # small plaintext is allocated, never a copy of the whole file
+        with self._mapped(file_path) as data:
+            if data[:len(LOG_MAGIC)] != LOG_MAGIC:
+                # Legacy format: one token holding the whole history
+                legacy = _loads(self._decrypt(bytes(data)))
+                return {'peer_id': legacy.get('peer_id')}, legacy.get('messages', [])
+
+            records, skipped = self._decode_records(data, skip_bad)
+
+        if skipped:
+            print(f"⚠️ Skipped {skipped} unreadable record(s) in {os.path.basename(file_path)}")
+
+        header = None
+        messages = []
+        for position, (chunk_count, record) in enumerate(records):
+            if record is None:
+                continue
+            if chunk_count is not None:
+                messages.extend(record)
+            elif position == 0:
+                header = record
+            else:
+                messages.append(record)
+        return header, messages
+
+    # ---------- Sidecar index ----------
+
+    def _load_index(self) -> Dict[str, Dict]:
+        """
+        Load index.enc and reconcile it with the chat files on disk.
+        Files missing from the index (new install) or whose size differs from
+        the recorded one (appended after the index was last written) are
+        scanned once; entries for deleted files are dropped.
+        """
+        index: Dict[str, Dict] = {}
+        try:
+            with open(self._index_path, 'rb') as f:
+                index = _loads(self._decrypt(f.read()))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Chat history index unreadable, rebuilding: {e}")
+
+        try:
+            on_disk = self._chat_files()
+        except Exception as e:
+            print(f"⚠️ Error listing chat history: {e}")
+            return index
+
+        changed = False
+        for filename in set(index) - on_disk.keys():
+            del index[filename]
+            changed = True
+
+        missing = sorted(
+            filename for filename, entry in on_disk.items()
+            if filename not in index or index[filename].get('size') != entry.stat().st_size
+        )
+        if missing:
+            paths = [os.path.join(self.user_dir, f) for f in missing]
+            peer_ids = self._map_files(self._peer_id_of, paths)
+            counts = self._map_files(self._count_messages_safe, paths)
+            for filename, path, peer_id, count in zip(missing, paths, peer_ids, counts):
+                st = on_disk[filename].stat()
+                index[filename] = {
+                    'peer_id': peer_id,
+                    'count': count,
+                    'mtime': st.st_mtime,
+                    'size': st.st_size,
+                }
+            changed = True
+
+        if changed:
+            self._index = index
+            self._save_index()
+        return index
+
+    def _save_index(self):
+        """Encrypt and atomically replace index.enc."""
+        try:
+            token = self._encrypt(_dumps(self._index))
+            tmp_path = self._index_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(token)
+            os.replace(tmp_path, self._index_path)
+            self._index_dirty = False
+            self._index_saved_at = time.monotonic()
+        except Exception as e:
+            print(f"⚠️ Error saving chat history index: {e}")
+
+    def _index_update(self, file_path: str, peer_id: str, count: int, tail: int = 0,
+                      persist: bool = False):
+        """
+        Record a peer file's message count, uncompacted tail length, last
+        activity and size. Written to disk if persist is set or the index
+        has been unsaved for INDEX_SAVE_INTERVAL; otherwise only marked dirty.
+        """
+        self._index[os.path.basename(file_path)] = {
+            'peer_id': peer_id,
+            'count': count,
+            'tail': tail,
+            'mtime': time.time(),
+            'size': os.path.getsize(file_path),
+        }
+        self._index_dirty = True
+        if persist or time.monotonic() - self._index_saved_at >= INDEX_SAVE_INTERVAL:
+            self._save_index()
+
+    # ---------- Decrypted history cache ----------
+
+    @staticmethod
+    def _stat_token(file_path: str) -> Tuple[int, int]:
+        """Validity token for a cached history: (mtime in ns, size)."""
+        st = os.stat(file_path)
+        return st.st_mtime_ns, st.st_size
+
+    def _cache_put(self, peer_id: str, token: Tuple[int, int], messages: List[Dict]):
+        """Store a decrypted history, evicting the least recently used peer."""
+        self._hist_cache[peer_id] = (token, messages)
+        self._hist_cache.move_to_end(peer_id)
+        while len(self._hist_cache) > HISTORY_CACHE_SIZE:
+            self._hist_cache.popitem(last=False)
+
     def _load_peer_history(self, peer_id: str) -> List[Dict]:
-        """Load and decrypt chat history for a peer."""
+        """Load and decrypt chat history for a peer (cached while unchanged on disk)."""
         file_path = self._get_peer_file(peer_id)
 
         try:
-            if not os.path.exists(file_path):
+            try:
+                token = self._stat_token(file_path)
+            except FileNotFoundError:
+                self._hist_cache.pop(peer_id, None)
                 return []
 
-            # Read encrypted file
-            with open(file_path, 'rb') as f:
-                ciphertext = f.read()
-
-            # Decrypt
-            plaintext = self.fernet.decrypt(ciphertext)
+            cached = self._hist_cache.get(peer_id)
+            if cached and cached[0] == token:
+                self._hist_cache.move_to_end(peer_id)
+                return list(cached[1])
 
-            # Parse JSON
-            data = json.loads(plaintext.decode('utf-8'))
-            return data.get('messages', [])
+            _, messages = self._read_file(file_path)
+            self._cache_put(peer_id, token, messages)
+            return list(messages)
 
         except Exception as e:
             print(f"⚠️ Error loading chat history for {peer_id}: {e}")
             return []
 
     def _save_peer_history(self, peer_id: str, messages: List[Dict]):
-        """Encrypt and save chat history for a peer."""
+        """
+        Encrypt and (re)write the whole chat history for a peer as a compacted
+        log: the header plus chunk records of up to COMPACT_EVERY messages.
+        """
         file_path = self._get_peer_file(peer_id)
 
         try:
-            # Create data structure
-            data = {
+            header = {
                 'peer_id': peer_id,
-                'last_updated': datetime.now().isoformat(),
-                'messages': messages
+                'created': now_timestamp(),
             }
-
-            # Convert to JSON
-            plaintext = json.dumps(data, indent=2).encode('utf-8')
-
-            # Encrypt
-            ciphertext = self.fernet.encrypt(plaintext)
-
-            # Write to file
-            with open(file_path, 'wb') as f:
-                f.write(ciphertext)
+            parts = [LOG_MAGIC, self._encode_record(header)]
+            parts.extend(self._encode_chunk(messages[i:i + COMPACT_EVERY])
+                         for i in range(0, len(messages), COMPACT_EVERY))
+
+            # Write to a temp file and swap it in, so a crash never leaves a partial history
+            tmp_path = file_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(b''.join(parts))
+            self._close_append_fd(file_path)
+            os.replace(tmp_path, file_path)
+            self._cache_put(peer_id, self._stat_token(file_path), list(messages))
+            self._index_update(file_path, peer_id, len(messages), persist=True)
 
         except Exception as e:
             print(f"❌ Error saving chat history for {peer_id}: {e}")
 
-    def add_message(self, peer_id: str, message: Dict):
+    # ---------- Append descriptors ----------
+
+    def _get_append_fd(self, file_path: str) -> int:
+        """Cached O_APPEND descriptor for an existing log file."""
+        fd = self._append_fds.get(file_path)
+        if fd is None:
+            fd = os.open(file_path, os.O_WRONLY | os.O_APPEND | getattr(os, 'O_BINARY', 0))
+            self._append_fds[file_path] = fd
+        return fd
+
+    def _close_append_fd(self, file_path: str):
+        """Close the cached descriptor for a file about to be replaced or removed."""
+        fd = self._append_fds.pop(file_path, None)
+        if fd is not None:
+            os.close(fd)
+
+    def _sync_append_fds(self):
+        """Flush appended records to disk."""
+        sync = getattr(os, 'fdatasync', os.fsync)
+        for fd in self._append_fds.values():
+            try:
+                sync(fd)
+            except OSError:
+                pass
+        self._appends_since_sync = 0
+
+    @_locked
+    def close(self):
+        """
+        Sync and close all cached append descriptors and write the index if
+        it changed (safe to call twice).
+        """
+        self._sync_append_fds()
+        for file_path in list(self._append_fds):
+            self._close_append_fd(file_path)
+        if self._index_dirty:
+            self._save_index()
+
+    def _is_log_file(self, file_path: str) -> bool:
+        """True if file_path exists and is in the append-only log format."""
+        try:
+            with open(file_path, 'rb') as f:
+                return f.read(len(LOG_MAGIC)) == LOG_MAGIC
+        except FileNotFoundError:
+            return False
+
+    @_locked
+    def add_message(self, peer_id: str, message: Union[Dict, ChatMessage]):
         """
         Add a message to peer's chat history.
 
+        Only the new message is encrypted and appended; the existing history
+        is not read (except once, to convert a legacy-format file).
+
         Args:
             peer_id: Unique identifier for the peer
-            message: Dict with keys: timestamp, sender, text, type
+            message: ChatMessage, or dict with keys: timestamp, sender, text, type
         """
         if not peer_id:
             return
 
-        # Load existing history
-        messages = self._load_peer_history(peer_id)
+        if isinstance(message, ChatMessage):
+            message = message.to_dict()
 
         # Add timestamp if not present
-        if 'timestamp' not in message:
-            message['timestamp'] = datetime.now().isoformat()
+        if not message.get('timestamp'):
+            message['timestamp'] = now_timestamp()
 
-        # Append new message
-        messages.append(message)
+        file_path = self._get_peer_file(peer_id)
+
+        if file_path not in self._append_fds and not self._is_log_file(file_path):
+            # New peer (or legacy file): write header plus any old messages.
+            # An unreadable legacy file is left alone rather than overwritten
+            try:
+                _, messages = self._read_file(file_path, skip_bad=False)
+            except FileNotFoundError:
+                messages = []
+            except Exception as e:
+                print(f"❌ Error converting chat history for {peer_id}: {e}")
+                return
+            messages.append(message)
+            self._save_peer_history(peer_id, messages)
+            return
+
+        try:
+            # Keep a cached copy current instead of re-decrypting on next load
+            cached = self._hist_cache.get(peer_id)
+            if cached and cached[0] != self._stat_token(file_path):
+                cached = None
+            os.write(self._get_append_fd(file_path), self._encode_record(message))
+            self._appends_since_sync += 1
+            if self._appends_since_sync >= COMPACT_EVERY:
+                self._sync_append_fds()
+            if cached:
+                cached[1].append(message)
+                self._cache_put(peer_id, self._stat_token(file_path), cached[1])
+            else:
+                self._hist_cache.pop(peer_id, None)
+
+            entry = self._index.get(os.path.basename(file_path))
+            count = entry['count'] + 1 if entry else self._count_messages(file_path)
+            tail = entry.get('tail', 0) + 1 if entry else 1
+
+            if tail >= COMPACT_EVERY:
+                self._compact(peer_id, file_path, count)
+            else:
+                self._index_update(file_path, peer_id, count, tail)
+        except Exception as e:
+            print(f"❌ Error saving chat history for {peer_id}: {e}")
 
-        # Save updated history
+    def _compact(self, peer_id: str, file_path: str, count: int):
+        """
+        Fold the appended single records into chunks (resets the tail).
+        Rewriting drops whatever was not read, so a file with an unreadable
+        record is left as is.
+        """
+        try:
+            _, messages = self._read_file(file_path, skip_bad=False)
+        except Exception as e:
+            print(f"⚠️ Chat history for {peer_id} not compacted: {e!r}")
+            # Retry after another COMPACT_EVERY appends, not on every one
+            self._index_update(file_path, peer_id, count, 0)
+            return
         self._save_peer_history(peer_id, messages)
 
+    def _read_header(self, file_path: str) -> Optional[Dict]:
+        """Decrypt only the header record of a chat file (legacy: whole file)."""
+        with open(file_path, 'rb') as f:
+            magic = f.read(len(LOG_MAGIC))
+            if magic != LOG_MAGIC:
+                header, _ = self._read_file(file_path)
+                return header
+            prefix = f.read(_RECORD_LEN.size)
+            if len(prefix) < _RECORD_LEN.size:
+                return None
+            (length,) = _RECORD_LEN.unpack(prefix)
+            if length & _CHUNK_FLAG:
+                return None  # The header is never a chunk
+            token = f.read(length)
+        return _loads(self._decrypt(token))
+
+    def _peer_id_of(self, file_path: str) -> Optional[str]:
+        """peer_id stored in a chat file's header, or None if unreadable."""
+        try:
+            header = self._read_header(file_path)
+            return header.get('peer_id') if header else None
+        except Exception:
+            return None
+
+    def _count_messages_safe(self, file_path: str) -> int:
+        """_count_messages, treating an unreadable file as empty."""
+        try:
+            return self._count_messages(file_path)
+        except Exception:
+            return 0
+
+    @staticmethod
+    def _map_files(func, paths: List[str]) -> List:
+        """
+        Apply func to every path, fanning out to a thread pool when there is
+        more than one file (cryptography releases the GIL while decrypting).
+        """
+        if len(paths) <= 1:
+            return [func(p) for p in paths]
+        with ThreadPoolExecutor(max_workers=min(SCAN_WORKERS, len(paths))) as ex:
+            return list(ex.map(func, paths))
+
+    def _count_messages(self, file_path: str) -> int:
+        """Count message records by walking length prefixes (no decryption)."""
+        with self._mapped(file_path) as data:
+            if data[:len(LOG_MAGIC)] == LOG_MAGIC:
+                records = sum(chunk_count or 1 for chunk_count, _ in self._iter_tokens(data))
+                return max(records - 1, 0)
+        _, messages = self._read_file(file_path)
+        return len(messages)
+
+    @_locked
     def get_messages(self, peer_id: str, limit: Optional[int] = None) -> List[Dict]:
         """
         Get chat history with a peer.
@@ -165,6 +698,7 @@ class ChatHistoryManager:
 
         return messages
 
+    @_locked
     def get_recent_peers(self, limit: int = 10) -> List[str]:
         """
         Get list of peers with recent chat history.
@@ -175,31 +709,10 @@ class ChatHistoryManager:
         Returns:
             List of peer_ids, sorted by most recent activity
         """
-        peer_files = []
-
         try:
-            for filename in os.listdir(self.user_dir):
-                if filename.startswith('chat_') and filename.endswith('.enc'):
-                    file_path = os.path.join(self.user_dir, filename)
-                    mtime = os.path.getmtime(file_path)
-                    peer_files.append((filename, mtime))
-
-            # Sort by modification time (newest first)
-            peer_files.sort(key=lambda x: x[1], reverse=True)
-
-            # Extract peer IDs from filenames
-            peer_ids = []
-            for filename, _ in peer_files[:limit]:
-                # Decrypt file to get real peer_id
-                file_path = os.path.join(self.user_dir, filename)
-                try:
-                    with open(file_path, 'rb') as f:
-                        ciphertext = f.read()
-                    plaintext = self.fernet.decrypt(ciphertext)
-                    data = json.loads(plaintext.decode('utf-8'))
-                    peer_ids.append(data.get('peer_id'))
-                except:
-                    continue
+            # Newest activity first, straight from the index
+            entries = sorted(self._index.values(), key=lambda e: e['mtime'], reverse=True)
+            peer_ids = [e['peer_id'] for e in entries[:limit]]
 
             return [p for p in peer_ids if p]
 
@@ -207,6 +720,7 @@ class ChatHistoryManager:
             print(f"⚠️ Error getting recent peers: {e}")
             return []
 
+    @_locked
     def delete_peer_history(self, peer_id: str) -> bool:
         """
         Delete all chat history with a peer.
@@ -221,13 +735,18 @@ class ChatHistoryManager:
 
         try:
             if os.path.exists(file_path):
+                self._close_append_fd(file_path)
                 os.remove(file_path)
+                self._hist_cache.pop(peer_id, None)
+                self._index.pop(os.path.basename(file_path), None)
+                self._save_index()
                 return True
             return False
         except Exception as e:
             print(f"❌ Error deleting chat history for {peer_id}: {e}")
             return False
 
+    @_locked
     def clear_all_history(self) -> bool:
         """
         Delete all chat history for this user.
@@ -237,15 +756,18 @@ class ChatHistoryManager:
             True if successful
         """
         try:
-            for filename in os.listdir(self.user_dir):
-                if filename.startswith('chat_') and filename.endswith('.enc'):
-                    file_path = os.path.join(self.user_dir, filename)
-                    os.remove(file_path)
+            self.close()
+            for entry in self._chat_files().values():
+                os.remove(entry.path)
+            self._hist_cache.clear()
+            self._index.clear()
+            self._save_index()
             return True
         except Exception as e:
             print(f"❌ Error clearing all history: {e}")
             return False
 
+    @_locked
     def export_peer_history(self, peer_id: str, output_file: str) -> bool:
         """
         Export chat history with a peer to plain text file.
@@ -283,6 +805,7 @@ class ChatHistoryManager:
             print(f"❌ Error exporting chat history: {e}")
             return False
 
+    @_locked
     def get_statistics(self) -> Dict:
         """
         Get statistics about chat history.
@@ -291,22 +814,8 @@ class ChatHistoryManager:
             Dict with statistics (total_peers, total_messages, etc.)
         """
         try:
-            total_peers = 0
-            total_messages = 0
-
-            for filename in os.listdir(self.user_dir):
-                if filename.startswith('chat_') and filename.endswith('.enc'):
-                    total_peers += 1
-                    file_path = os.path.join(self.user_dir, filename)
-
-                    try:
-                        with open(file_path, 'rb') as f:
-                            ciphertext = f.read()
-                        plaintext = self.fernet.decrypt(ciphertext)
-                        data = json.loads(plaintext.decode('utf-8'))
-                        total_messages += len(data.get('messages', []))
-                    except:
-                        continue
+            total_peers = len(self._index)
+            total_messages = sum(e['count'] for e in self._index.values())
 
             return {
                 'total_peers': total_peers,
@@ -4,80 +4,164 @@
 Persistent contact book:
 - Maps friendly names to peer_id and certificate fingerprints.
 - Stored as JSON in the user's home directory.
+
+Group several changes into one write with `with contact_book: ...`.
 """
 
-import json
 import os
+from dataclasses import dataclass
 from typing import Dict, List, Optional
 from datetime import datetime
 
+from session.jsonutil import dumps, loads
+
+# Resolved once at import instead of on every ContactBook()
+_CONTACTS_PATH = os.path.expanduser("~/.dnie_im_contacts.json")
+
+
+@dataclass(slots=True)
+class Contact:
+    """
+    A trusted contact.
+    Slotted to keep per-contact memory small; stored on disk as a plain dict.
+    """
+    peer_id: str
+    fingerprint: str
+    added: str
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Contact":
+        """Build a Contact from its on-disk dict representation."""
+        return cls(
+            peer_id=data.get("peer_id", ""),
+            fingerprint=data.get("fingerprint", ""),
+            added=data.get("added", ""),
+        )
+
+    def to_dict(self) -> dict:
+        """Return the on-disk dict representation."""
+        return {
+            "peer_id": self.peer_id,
+            "fingerprint": self.fingerprint,
+            "added": self.added,
+        }
+
 
 class ContactBook:
     """
     Stores trusted contacts:
-        name -> { peer_id, fingerprint, added }
+        name -> Contact(peer_id, fingerprint, added)
     """
 
     def __init__(self):
-        self.contacts_file = os.path.expanduser("~/.dnie_im_contacts.json")
-        self.contacts: Dict[str, dict] = {}
+        self.contacts_file = _CONTACTS_PATH
+        self.contacts: Dict[str, Contact] = {}
+        # Reverse indexes: fingerprint / peer_id -> first contact name with it
+        self._by_fp: Dict[str, str] = {}
+        self._by_pid: Dict[str, str] = {}
+        # Writes are deferred while inside `with contact_book:` blocks
+        self._batch_depth = 0
+        self._dirty = False
         self.load_contacts()
 
+    def __enter__(self):
+        self._batch_depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._batch_depth -= 1
+        if self._batch_depth == 0 and self._dirty:
+            self.save_contacts()
+        return False
+
+    def _index(self, name: str, contact: Contact):
+        """Add a contact to the reverse indexes (earlier contacts win)."""
+        if contact.fingerprint:
+            self._by_fp.setdefault(contact.fingerprint, name)
+        if contact.peer_id:
+            self._by_pid.setdefault(contact.peer_id, name)
+
+    def _unindex(self, name: str, contact: Contact):
+        """Drop a contact from the reverse indexes, repointing to another holder if any."""
+        for index, field in ((self._by_fp, "fingerprint"), (self._by_pid, "peer_id")):
+            value = getattr(contact, field)
+            if value and index.get(value) == name:
+                del index[value]
+                for other, other_contact in self.contacts.items():
+                    if other != name and getattr(other_contact, field) == value:
+                        index[value] = other
+                        break
+
+    def _rebuild_indexes(self):
+        """Rebuild both reverse indexes from self.contacts."""
+        self._by_fp.clear()
+        self._by_pid.clear()
+        for name, contact in self.contacts.items():
+            self._index(name, contact)
+
     def load_contacts(self):
         """Load contacts from disk."""
         try:
             if os.path.exists(self.contacts_file):
-                with open(self.contacts_file, "r", encoding="utf-8") as f:
-                    self.contacts = json.load(f)
+                with open(self.contacts_file, "rb") as f:
+                    self.contacts = {
+                        name: Contact.from_dict(info) for name, info in loads(f.read()).items()
+                    }
                 print(f"📖 Cargados {len(self.contacts)} contactos")
         except Exception as e:
             print(f"⚠️ Error cargando contactos: {e}")
             self.contacts = {}
+        self._rebuild_indexes()
 
     def save_contacts(self):
-        """Save contacts to disk."""
+        """Save contacts to disk (deferred inside a `with` block)."""
+        if self._batch_depth > 0:
+            self._dirty = True
+            return
         try:
-            with open(self.contacts_file, "w", encoding="utf-8") as f:
-                json.dump(self.contacts, f, indent=2, ensure_ascii=False)
+            # Write a temp file and swap it in so the book is never half-written
+            tmp_file = self.contacts_file + ".tmp"
+            with open(tmp_file, "wb") as f:
+                f.write(dumps({name: c.to_dict() for name, c in self.contacts.items()}))
+            os.replace(tmp_file, self.contacts_file)
+            self._dirty = False
         except Exception as e:
             print(f"⚠️ Error guardando contactos: {e}")
 
     def add_contact(self, name: str, peer_id: str, fingerprint: str):
         """Add or update a contact."""
-        self.contacts[name] = {
-            "peer_id": peer_id,
-            "fingerprint": fingerprint,
-            "added": datetime.now().isoformat(),
-        }
+        if name in self.contacts:
+            self._unindex(name, self.contacts[name])
+        self.contacts[name] = contact = Contact(
+            peer_id=peer_id,
+            fingerprint=fingerprint,
+            added=datetime.now().isoformat(),
+        )
+        self._index(name, contact)
         self.save_contacts()
         print(f"✅ Contacto añadido: {name}")
 
-    def get_contact(self, name: str) -> Optional[dict]:
+    def get_contact(self, name: str) -> Optional[Contact]:
         """Get a contact by friendly name."""
         return self.contacts.get(name)
 
     def find_by_fingerprint(self, fingerprint: str) -> Optional[str]:
         """Find contact name by certificate fingerprint."""
-        for name, info in self.contacts.items():
-            if info.get("fingerprint") == fingerprint:
-                return name
-        return None
+        return self._by_fp.get(fingerprint)
 
     def find_by_peer_id(self, peer_id: str) -> Optional[str]:
         """Find contact name by peer_id."""
-        for name, info in self.contacts.items():
-            if info.get("peer_id") == peer_id:
-                return name
-        return None
+        return self._by_pid.get(peer_id)
 
     def list_contacts(self) -> List[dict]:
         """Return a list of contact dicts with 'name' included."""
-        return [{"name": name, **info} for name, info in self.contacts.items()]
+        return [{"name": name, **c.to_dict()} for name, c in self.contacts.items()]
 
     def remove_contact(self, name: str) -> bool:
         """Remove contact by name, returning True if it existed."""
         if name in self.contacts:
-            del self.contacts[name]
+            contact = self.contacts.pop(name)
+            self._unindex(name, contact)
             self.save_contacts()
             print(f"🗑️ Contacto eliminado: {name}")
             return True
@@ -85,4 +169,4 @@ class ContactBook:
 
     def is_trusted(self, peer_id: str) -> bool:
         """Check if a given peer_id is in the contact book."""
-        return self.find_by_peer_id(peer_id) is not None
+        return peer_id in self._by_pid
@@ -0,0 +1,29 @@
+# dnie_im/session/jsonutil.py
+
+"""
+JSON helpers for the on-disk stores (chat history, message queue, contacts).
+Uses orjson when it is installed; otherwise stdlib json with the same
+compact UTF-8 output.
+"""
+
+import json
+
+# orjson is optional: faster C encoder/decoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj) -> bytes:
+    """Serialize obj to compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    """Parse JSON from UTF-8 bytes (or str)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -3,16 +3,102 @@
 """
 Message queue manager for offline peers.
 Stores undelivered messages and sends them when peer reconnects.
-Uses Fernet encryption like chat history.
+Uses AES-GCM encryption like chat history.
+
+On-disk format (per peer): QUEUE_MAGIC followed by length-prefixed records,
+each an encrypted JSON object: a {'peer_id', 'created'} header, then
+one record per message. Enqueueing appends a single record. Files written by
+older versions (one token holding the whole queue) are still read and are
+rewritten in the log format on their next enqueue.
+
+When zstandard is installed, records of COMPRESS_MIN_SIZE bytes or more
+are zstd-compressed before encryption (reading them back then also needs
+zstandard).
 """
 
 import os
-import json
+import struct
 import hashlib
 import base64
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from typing import Dict, List, Optional
+from functools import cached_property
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from session.jsonutil import dumps, loads
+
+# zstandard is optional: compresses larger records before encryption
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Derived keys by sha256(certificate || salt), so re-creating a queue for
+# the same certificate (e.g. after a reconnect) skips the 100k-iteration PBKDF2
+_KEY_SALT = b'dnie_message_queue_salt'  # Different salt
+_KEY_CACHE: Dict[bytes, Tuple[bytes, bytes]] = {}  # -> (raw key, Fernet key)
+_KEY_CACHE_LOCK = threading.Lock()
+
+# Leading byte of AES-GCM blobs (Fernet tokens are base64 text starting with b'g')
+AEAD_VERSION = b"\x02"
+AEAD_NONCE_SIZE = 12
+
+# Number of peers whose decrypted queue is kept in memory
+QUEUE_CACHE_SIZE = 128
+
+# Project root (two levels above this package), resolved once at import
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Number of peer_id -> queue file path entries kept per instance
+PATH_CACHE_SIZE = 1024
+
+# Marks a queue file in the append-only log format
+QUEUE_MAGIC = b"DNIEQUEUE1\n"
+# Big-endian length prefix of each record
+_RECORD_LEN = struct.Struct(">I")
+
+def _name_hash(value: str) -> str:
+    """Filename-safe 16-hex-digit hash of a user or peer id."""
+    return hashlib.blake2b(value.encode(), digest_size=8).hexdigest()
+
+
+def _legacy_name_hash(value: str) -> str:
+    """Name hash used by older versions (truncated SHA-256)."""
+    return hashlib.sha256(value.encode()).hexdigest()[:16]
+
+
+# Records shorter than this are stored uncompressed (zstd gains nothing)
+COMPRESS_MIN_SIZE = 256
+# zstd frame magic; JSON plaintext never starts with it
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_ZSTD_COMPRESSOR = zstandard.ZstdCompressor(level=3) if zstandard else None
+_ZSTD_DECOMPRESSOR = zstandard.ZstdDecompressor() if zstandard else None
+
+
+def _pack(obj) -> bytes:
+    """Serialize obj to JSON, zstd-compressed when available and worthwhile."""
+    data = dumps(obj)
+    if _ZSTD_COMPRESSOR is not None and len(data) >= COMPRESS_MIN_SIZE:
+        compressed = _ZSTD_COMPRESSOR.compress(data)
+        if len(compressed) < len(data):
+            return compressed
+    return data
+
+
+def _unpack(data: bytes):
+    """Parse a record plaintext written by _pack."""
+    if data[:4] == _ZSTD_MAGIC:
+        if _ZSTD_DECOMPRESSOR is None:
+            raise RuntimeError("zstandard is required to read compressed queue records")
+        data = _ZSTD_DECOMPRESSOR.decompress(data)
+    return loads(data)
+
+
+# Encrypted sidecar: queue filename -> {'peer_id', 'count'} for non-empty queues
+INDEX_FILE = "index.enc"
 
 
 class MessageQueue:
@@ -32,61 +118,297 @@ class MessageQueue:
         self.user_id = user_id
         self.certificate = certificate
 
-        # Derive Fernet key from certificate
-        self.fernet_key = self._derive_key_from_certificate(certificate)
-        self.fernet = Fernet(self.fernet_key)
+        # Key derivation (PBKDF2), the queue directory and the index are set
+        # up lazily by the properties below, on first use: a session in
+        # which no peer goes offline never pays for them.
+        self._path_cache: "OrderedDict[str, str]" = OrderedDict()
+
+        # Decrypted queues: peer_id -> ((st_mtime_ns, st_size), messages),
+        # used only while the file's stat token still matches
+        self._queue_cache: "OrderedDict[str, Tuple[Tuple[int, int], List[Dict]]]" = OrderedDict()
+
+    @cached_property
+    def _keys(self) -> Tuple[bytes, bytes]:
+        return self._derive_keys_from_certificate(self.certificate)
+
+    @cached_property
+    def fernet_key(self) -> bytes:
+        return self._keys[1]
+
+    @cached_property
+    def fernet(self) -> Fernet:
+        # Only used to read files written by older versions
+        return Fernet(self.fernet_key)
+
+    @cached_property
+    def aead(self) -> AESGCM:
+        return AESGCM(self._keys[0])
 
-        # Setup queue directory
+    @cached_property
+    def user_dir(self) -> str:
         self._setup_directories()
+        return self.__dict__['user_dir']
 
-    def _derive_key_from_certificate(self, certificate: bytes) -> bytes:
-        """Derive Fernet encryption key from DNIe certificate."""
-        derived = hashlib.pbkdf2_hmac(
-            'sha256',
-            certificate,
-            b'dnie_message_queue_salt',  # Different salt
-            100000,
-            32
-        )
-        return base64.urlsafe_b64encode(derived)
+    @cached_property
+    def _index_path(self) -> str:
+        return os.path.join(self.user_dir, INDEX_FILE)
+
+    @cached_property
+    def _index(self) -> Dict[str, Dict]:
+        """
+        Non-empty queues by filename, so counts, emptiness checks and
+        statistics need no decrypt. Queue files are only written when
+        non-empty and deleted when empty.
+        """
+        self.__dict__['_index'] = self._load_index()
+        self._migrate_legacy_files()
+        return self.__dict__['_index']
+
+    def _load_index(self) -> Dict[str, Dict]:
+        """
+        Load index.enc and reconcile it with the queue files on disk: files
+        missing from the index are decrypted once, stale entries dropped.
+        """
+        index: Dict[str, Dict] = {}
+        try:
+            with open(self._index_path, 'rb') as f:
+                index = loads(self._decrypt(f.read(), INDEX_FILE))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ Message queue index unreadable, rebuilding: {e}")
+
+        # One directory read; DirEntry carries the full path
+        with os.scandir(self.user_dir) as it:
+            on_disk = {
+                entry.name: entry.path for entry in it
+                if entry.name.startswith('queue_') and entry.name.endswith('.enc')
+            }
+
+        changed = False
+        for filename in set(index) - on_disk.keys():
+            del index[filename]
+            changed = True
+
+        for filename in on_disk.keys() - set(index):
+            try:
+                header, messages = self._read_file(on_disk[filename])
+                index[filename] = {
+                    'peer_id': header.get('peer_id') if header else None,
+                    'count': len(messages),
+                }
+                changed = True
+            except Exception:
+                continue
+
+        if changed:
+            self._index = index
+            self._save_index()
+        return index
+
+    def _save_index(self):
+        """Encrypt and atomically replace index.enc."""
+        try:
+            tmp_path = self._index_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(self._encrypt(dumps(self._index), INDEX_FILE))
+            os.replace(tmp_path, self._index_path)
+        except Exception as e:
+            print(f"⚠️ Error saving message queue index: {e}")
+
+    def _cache_put(self, peer_id: str, token: Tuple[int, int], messages: List[Dict]):
+        """Store a decrypted queue, evicting the least recently used peer."""
+        self._queue_cache[peer_id] = (token, messages)
+        self._queue_cache.move_to_end(peer_id)
+        while len(self._queue_cache) > QUEUE_CACHE_SIZE:
+            self._queue_cache.popitem(last=False)
+
+    def _derive_keys_from_certificate(self, certificate: bytes) -> Tuple[bytes, bytes]:
+        """
+        Derive the raw 32-byte key and its base64 Fernet form from DNIe
+        certificate (once per process for a given certificate).
+        """
+        tag = hashlib.sha256(certificate + _KEY_SALT).digest()
+        with _KEY_CACHE_LOCK:
+            keys = _KEY_CACHE.get(tag)
+            if keys is None:
+                derived = hashlib.pbkdf2_hmac(
+                    'sha256',
+                    certificate,
+                    _KEY_SALT,
+                    100000,
+                    32
+                )
+                keys = _KEY_CACHE[tag] = (derived, base64.urlsafe_b64encode(derived))
+        return keys
 
     def _setup_directories(self):
         """Create message queue directory structure."""
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        project_root = os.path.dirname(os.path.dirname(current_dir))
-
         # Create .MessageQueue directory
-        self.base_dir = os.path.join(project_root, ".MessageQueue")
+        self.base_dir = os.path.join(_PROJECT_ROOT, ".MessageQueue")
         os.makedirs(self.base_dir, exist_ok=True)
 
-        # Create user-specific directory
-        user_hash = hashlib.sha256(self.user_id.encode()).hexdigest()[:16]
-        self.user_dir = os.path.join(self.base_dir, f"user_{user_hash}")
+        # Create user-specific directory (renaming one left by an older version)
+        self.user_dir = os.path.join(self.base_dir, f"user_{_name_hash(self.user_id)}")
+        legacy_dir = os.path.join(self.base_dir, f"user_{_legacy_name_hash(self.user_id)}")
+        if os.path.isdir(legacy_dir) and not os.path.exists(self.user_dir):
+            os.rename(legacy_dir, self.user_dir)
         os.makedirs(self.user_dir, exist_ok=True)
 
     def _get_queue_file(self, peer_id: str) -> str:
-        """Get encrypted queue file path for a specific peer."""
-        safe_peer_id = hashlib.sha256(peer_id.encode()).hexdigest()[:16]
-        return os.path.join(self.user_dir, f"queue_{safe_peer_id}.enc")
+        """Get encrypted queue file path for a specific peer (memoized)."""
+        path = self._path_cache.get(peer_id)
+        if path is None:
+            path = os.path.join(self.user_dir, f"queue_{_name_hash(peer_id)}.enc")
+            self._path_cache[peer_id] = path
+            if len(self._path_cache) > PATH_CACHE_SIZE:
+                self._path_cache.popitem(last=False)
+        return path
+
+    def _migrate_legacy_files(self):
+        """
+        Move queues stored under older file names to the current ones.
+        Records are bound to their file name, so they are rewritten rather
+        than renamed; a queue already under the new name keeps its messages
+        after the older ones.
+        """
+        for filename, entry in list(self._index.items()):
+            peer_id = entry.get('peer_id')
+            if not peer_id:
+                continue
+            file_path = self._get_queue_file(peer_id)
+            if filename == os.path.basename(file_path):
+                continue
+            try:
+                legacy_path = os.path.join(self.user_dir, filename)
+                _, messages = self._read_file(legacy_path)
+                messages.extend(self._load_queue(peer_id))
+                self._save_queue(peer_id, messages)
+                os.remove(legacy_path)
+                del self._index[filename]
+                self._save_index()
+            except Exception as e:
+                print(f"⚠️ Error migrating message queue for {peer_id}: {e}")
+
+    # ---------- Encryption ----------
+
+    def _encrypt(self, plaintext: bytes, filename: str) -> bytes:
+        """
+        Encrypt with AES-256-GCM: AEAD_VERSION + nonce + ciphertext/tag.
+        The file name is bound as associated data, so a blob moved into
+        another peer's queue file fails to decrypt.
+        """
+        nonce = os.urandom(AEAD_NONCE_SIZE)
+        return AEAD_VERSION + nonce + self.aead.encrypt(nonce, plaintext, filename.encode())
+
+    def _decrypt(self, blob: bytes, filename: str) -> bytes:
+        """Decrypt an AES-GCM blob, or a Fernet token from an older version."""
+        if blob[:1] == AEAD_VERSION:
+            nonce_end = 1 + AEAD_NONCE_SIZE
+            return self.aead.decrypt(blob[1:nonce_end], blob[nonce_end:], filename.encode())
+        return self.fernet.decrypt(blob)
+
+    # ---------- Record log ----------
+
+    def _encode_record(self, obj: Dict, filename: str) -> bytes:
+        """Encrypt one JSON object into a length-prefixed record."""
+        token = self._encrypt(_pack(obj), filename)
+        return _RECORD_LEN.pack(len(token)) + token
+
+    @staticmethod
+    def _iter_tokens(f: BinaryIO) -> Iterator[bytes]:
+        """
+        Yield the encrypted records of a log-format file, reading one record
+        at a time from f (positioned just after QUEUE_MAGIC).
+        A truncated trailing record (e.g. interrupted write) is ignored.
+        """
+        while True:
+            prefix = f.read(_RECORD_LEN.size)
+            if len(prefix) < _RECORD_LEN.size:
+                return
+            (length,) = _RECORD_LEN.unpack(prefix)
+            token = f.read(length)
+            if len(token) < length:
+                return
+            yield token
+
+    def _iter_file(self, file_path: str) -> Iterator[Dict]:
+        """
+        Stream the decrypted records of a queue file of either format: the
+        header first, then one dict per message. Only one record is held in
+        memory at a time (legacy files are decrypted whole).
+        """
+        filename = os.path.basename(file_path)
+        with open(file_path, 'rb') as f:
+            if f.read(len(QUEUE_MAGIC)) != QUEUE_MAGIC:
+                # Legacy format: one token holding the whole queue
+                f.seek(0)
+                legacy = loads(self.fernet.decrypt(f.read()))
+                yield {'peer_id': legacy.get('peer_id')}
+                yield from legacy.get('messages', [])
+                return
+
+            for token in self._iter_tokens(f):
+                yield _unpack(self._decrypt(token, filename))
+
+    def _read_file(self, file_path: str) -> Tuple[Optional[Dict], List[Dict]]:
+        """
+        Read and decrypt a queue file of either format.
+        Returns (header, messages); header is None if the file has no header.
+        """
+        records = self._iter_file(file_path)
+        header = next(records, None)
+        return header, list(records)
+
+    def _iter_queue(self, peer_id: str) -> Iterator[Dict]:
+        """
+        Yield a peer's queued messages one at a time, from the cache when it
+        is current, otherwise streamed from disk without building the list.
+        """
+        file_path = self._get_queue_file(peer_id)
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            return
+
+        cached = self._queue_cache.get(peer_id)
+        if cached and cached[0] == (st.st_mtime_ns, st.st_size):
+            yield from list(cached[1])
+            return
+
+        records = self._iter_file(file_path)
+        next(records, None)  # Header
+        yield from records
+
+    def _is_log_file(self, file_path: str) -> bool:
+        """True if file_path exists and is in the append-only log format."""
+        try:
+            with open(file_path, 'rb') as f:
+                return f.read(len(QUEUE_MAGIC)) == QUEUE_MAGIC
+        except FileNotFoundError:
+            return False
 
     def _load_queue(self, peer_id: str) -> List[Dict]:
-        """Load and decrypt message queue for a peer."""
+        """Load and decrypt message queue for a peer (cached while unchanged on disk)."""
         file_path = self._get_queue_file(peer_id)
 
         try:
-            if not os.path.exists(file_path):
+            try:
+                st = os.stat(file_path)
+            except FileNotFoundError:
+                self._queue_cache.pop(peer_id, None)
                 return []
+            token = (st.st_mtime_ns, st.st_size)
 
-            # Read encrypted file
-            with open(file_path, 'rb') as f:
-                ciphertext = f.read()
-
-            # Decrypt
-            plaintext = self.fernet.decrypt(ciphertext)
+            cached = self._queue_cache.get(peer_id)
+            if cached and cached[0] == token:
+                self._queue_cache.move_to_end(peer_id)
+                return list(cached[1])
 
-            # Parse JSON
-            data = json.loads(plaintext.decode('utf-8'))
-            return data.get('messages', [])
+            # Read and decrypt every record
+            _, messages = self._read_file(file_path)
+            self._cache_put(peer_id, token, messages)
+            return list(messages)
 
         except Exception as e:
             print(f"⚠️ Error loading message queue for {peer_id}: {e}")
@@ -99,26 +421,33 @@ class MessageQueue:
         try:
             if not messages:
                 # Delete file if queue is empty
-                if os.path.exists(file_path):
-                    os.remove(file_path)
+                self._queue_cache.pop(peer_id, None)
+                try:
+                    os.unlink(file_path)
+                except FileNotFoundError:
+                    pass
+                if self._index.pop(os.path.basename(file_path), None) is not None:
+                    self._save_index()
                 return
 
-            # Create data structure
-            data = {
+            # Header record, then one record per message
+            header = {
                 'peer_id': peer_id,
-                'last_updated': datetime.now().isoformat(),
-                'messages': messages
+                'created': datetime.now().isoformat(),
             }
-
-            # Convert to JSON
-            plaintext = json.dumps(data, indent=2).encode('utf-8')
-
-            # Encrypt
-            ciphertext = self.fernet.encrypt(plaintext)
-
-            # Write to file
-            with open(file_path, 'wb') as f:
-                f.write(ciphertext)
+            filename = os.path.basename(file_path)
+            parts = [QUEUE_MAGIC, self._encode_record(header, filename)]
+            parts.extend(self._encode_record(m, filename) for m in messages)
+
+            # Write a temp file and swap it in so the queue is never half-written
+            tmp_path = file_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(b''.join(parts))
+            os.replace(tmp_path, file_path)
+            self._index[os.path.basename(file_path)] = {'peer_id': peer_id, 'count': len(messages)}
+            self._save_index()
+            st = os.stat(file_path)
+            self._cache_put(peer_id, (st.st_mtime_ns, st.st_size), list(messages))
 
         except Exception as e:
             print(f"❌ Error saving message queue for {peer_id}: {e}")
@@ -132,26 +461,76 @@ class MessageQueue:
             message_text: The message text to queue
             metadata: Optional metadata (sender, timestamp, etc.)
         """
-        if not peer_id or not message_text:
+        if not message_text:
             return
+        self.enqueue_messages(peer_id, [(message_text, metadata)])
 
-        # Load existing queue
-        queue = self._load_queue(peer_id)
+    def enqueue_messages(self, peer_id: str, items: List[Tuple[str, Optional[Dict]]]):
+        """
+        Add several messages to the queue for an offline peer with a single
+        file write and index update.
 
-        # Create message entry
-        message = {
-            'text': message_text,
-            'queued_at': datetime.now().isoformat(),
-            'metadata': metadata or {}
-        }
+        Args:
+            peer_id: Unique identifier for the peer
+            items: (message_text, metadata) pairs, in queue order
+        """
+        if not peer_id:
+            return
 
-        # Append to queue
-        queue.append(message)
+        # Create message entries
+        queued_at = datetime.now().isoformat()
+        messages = [
+            {'text': text, 'queued_at': queued_at, 'metadata': metadata or {}}
+            for text, metadata in items if text
+        ]
+        if not messages:
+            return
 
-        # Save updated queue
-        self._save_queue(peer_id, queue)
+        file_path = self._get_queue_file(peer_id)
 
-        print(f"📬 Mensaje encolado para {peer_id} (total: {len(queue)})")
+        if not self._is_log_file(file_path):
+            # New queue (or legacy file): write header plus any old messages
+            queue = self._load_queue(peer_id)
+            queue.extend(messages)
+            self._save_queue(peer_id, queue)
+            total = len(queue)
+        else:
+            total = self._append_messages(peer_id, file_path, messages)
+
+        if len(messages) == 1:
+            print(f"📬 Mensaje encolado para {peer_id} (total: {total})")
+        else:
+            print(f"📬 {len(messages)} mensajes encolados para {peer_id} (total: {total})")
+
+    def _append_messages(self, peer_id: str, file_path: str, messages: List[Dict]) -> int:
+        """Append message records to a log-format queue; returns the new count."""
+        filename = os.path.basename(file_path)
+        entry = self._index.get(filename)
+        try:
+            # Keep a cached copy current instead of re-decrypting on next load
+            cached = self._queue_cache.get(peer_id)
+            if cached:
+                st = os.stat(file_path)
+                if cached[0] != (st.st_mtime_ns, st.st_size):
+                    cached = None
+
+            with open(file_path, 'ab') as f:
+                f.write(b''.join(self._encode_record(m, filename) for m in messages))
+
+            if cached:
+                cached[1].extend(messages)
+                st = os.stat(file_path)
+                self._cache_put(peer_id, (st.st_mtime_ns, st.st_size), cached[1])
+            else:
+                self._queue_cache.pop(peer_id, None)
+
+            count = entry['count'] + len(messages) if entry else len(self._load_queue(peer_id))
+            self._index[filename] = {'peer_id': peer_id, 'count': count}
+            self._save_index()
+            return count
+        except Exception as e:
+            print(f"❌ Error saving message queue for {peer_id}: {e}")
+            return entry['count'] if entry else 0
 
     def get_queued_messages(self, peer_id: str, clear: bool = True) -> List[Dict]:
         """
@@ -164,9 +543,18 @@ class MessageQueue:
         Returns:
             List of queued message dicts
         """
-        queue = self._load_queue(peer_id)
+        if not clear:
+            return self._load_queue(peer_id)
 
-        if clear and queue:
+        # Delivered queues are deleted right after, so stream instead of caching
+        self._queue_cache.pop(peer_id, None)
+        try:
+            queue = list(self._iter_queue(peer_id))
+        except Exception as e:
+            print(f"⚠️ Error loading message queue for {peer_id}: {e}")
+            return []
+
+        if queue:
             # Clear the queue
             self._save_queue(peer_id, [])
 
@@ -182,8 +570,7 @@ class MessageQueue:
         Returns:
             True if there are queued messages
         """
-        queue = self._load_queue(peer_id)
-        return len(queue) > 0
+        return os.path.basename(self._get_queue_file(peer_id)) in self._index
 
     def get_queue_count(self, peer_id: str) -> int:
         """
@@ -195,8 +582,8 @@ class MessageQueue:
         Returns:
             Number of queued messages
         """
-        queue = self._load_queue(peer_id)
-        return len(queue)
+        entry = self._index.get(os.path.basename(self._get_queue_file(peer_id)))
+        return entry['count'] if entry else 0
 
     def clear_queue(self, peer_id: str) -> bool:
         """
@@ -222,28 +609,12 @@ class MessageQueue:
         Returns:
             Dict mapping peer_id to message count
         """
-        queues = {}
-
         try:
-            for filename in os.listdir(self.user_dir):
-                if filename.startswith('queue_') and filename.endswith('.enc'):
-                    file_path = os.path.join(self.user_dir, filename)
-
-                    try:
-                        with open(file_path, 'rb') as f:
-                            ciphertext = f.read()
-                        plaintext = self.fernet.decrypt(ciphertext)
-                        data = json.loads(plaintext.decode('utf-8'))
-
-                        peer_id = data.get('peer_id')
-                        message_count = len(data.get('messages', []))
-
-                        if peer_id and message_count > 0:
-                            queues[peer_id] = message_count
-                    except:
-                        continue
-
-            return queues
+            return {
+                entry['peer_id']: entry['count']
+                for entry in self._index.values()
+                if entry.get('peer_id') and entry.get('count', 0) > 0
+            }
 
         except Exception as e:
             print(f"⚠️ Error getting all queues: {e}")
@@ -257,25 +628,9 @@ class MessageQueue:
             Dict with statistics
         """
         try:
-            total_peers = 0
-            total_messages = 0
-
-            for filename in os.listdir(self.user_dir):
-                if filename.startswith('queue_') and filename.endswith('.enc'):
-                    file_path = os.path.join(self.user_dir, filename)
-
-                    try:
-                        with open(file_path, 'rb') as f:
-                            ciphertext = f.read()
-                        plaintext = self.fernet.decrypt(ciphertext)
-                        data = json.loads(plaintext.decode('utf-8'))
-
-                        message_count = len(data.get('messages', []))
-                        if message_count > 0:
-                            total_peers += 1
-                            total_messages += message_count
-                    except:
-                        continue
+            counts = [entry.get('count', 0) for entry in self._index.values()]
+            total_peers = sum(1 for c in counts if c > 0)
+            total_messages = sum(counts)
 
             return {
                 'total_peers_with_queue': total_peers,
@@ -4,12 +4,26 @@
 Session and peer data models.
 """
 
+import struct
 from dataclasses import dataclass, field
-from typing import Optional, List
+from enum import Enum
+from typing import Optional, List, Tuple
 from datetime import datetime
 
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
 
-@dataclass
+# Little-endian 64-bit nonce counter, precompiled (written at offset 4 of the nonce)
+_NONCE_COUNTER = struct.Struct("<Q")
+
+
+class PeerState(Enum):
+    """Handshake/connection state of a peer, as tracked by the messenger."""
+    IDLE = "idle"
+    INITIATED = "initiated"
+    ESTABLISHED = "established"
+
+
+@dataclass(slots=True)
 class Peer:
     """
     Represents a discovered peer in the local network.
@@ -21,9 +35,22 @@ class Peer:
     certificate_fingerprint: Optional[str] = None
     static_public_key: Optional[bytes] = None  # FIXED: Added for Noise IK
     last_seen: datetime = field(default_factory=datetime.now)
+    # (address, port); used as the key for per-peer bookkeeping dicts/sets
+    key: Tuple[str, int] = field(init=False, repr=False, compare=False)
+    # "address:port", computed once; used for display and as fallback identity
+    label: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.key = (self.address, self.port)
+        self.label = f"{self.address}:{self.port}"
 
+    @property
+    def identity(self) -> str:
+        """Stable identifier: peer_id when known, else address:port."""
+        return self.peer_id or self.label
 
-@dataclass
+
+@dataclass(slots=True)
 class Session:
     """
     Represents an active encrypted session with a peer.
@@ -37,6 +64,9 @@ class Session:
         recv_nonce: Monotonic counter for AEAD nonces (receiver).
         messages: Stored message metadata, if desired.
         authenticated: Whether DNIe-based auth (if any) has been completed.
+        initiator: Whether we sent the IK message that created this session.
+        send_cipher / recv_cipher: AEAD objects built once from the keys.
+        goodbye_frame: Prebuilt GOODBYE frame sent on shutdown.
     """
     connection_id: bytes
     peer: Peer
@@ -46,3 +76,36 @@ class Session:
     recv_nonce: int = 0
     messages: List[dict] = field(default_factory=list)
     authenticated: bool = False
+    initiator: bool = False
+    # Reusable nonce buffer: 4 zero bytes followed by the little-endian counter
+    nonce_buf: bytearray = field(default_factory=lambda: bytearray(12), init=False, repr=False)
+    send_cipher: Optional[ChaCha20Poly1305] = field(default=None, init=False, repr=False)
+    recv_cipher: Optional[ChaCha20Poly1305] = field(default=None, init=False, repr=False)
+    # Empty GOODBYE frame for this CID, built when the handshake completes
+    goodbye_frame: Optional[bytes] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        # Key setup happens once per session instead of once per frame
+        self.send_cipher = ChaCha20Poly1305(self.send_key)
+        self.recv_cipher = ChaCha20Poly1305(self.recv_key)
+
+    def wipe_keys(self):
+        """Overwrite the session keys and drop the ciphers holding them."""
+        self.send_key = b'\x00' * 32
+        self.recv_key = b'\x00' * 32
+        self.send_cipher = None
+        self.recv_cipher = None
+
+    def next_send_nonce(self) -> bytes:
+        """Return the 12-byte AEAD nonce for the next outgoing frame and advance send_nonce."""
+        _NONCE_COUNTER.pack_into(self.nonce_buf, 4, self.send_nonce)
+        self.send_nonce += 1
+        return bytes(self.nonce_buf)
+
+    def current_recv_nonce(self) -> bytes:
+        """
+        Return the 12-byte AEAD nonce expected for the next incoming frame.
+        recv_nonce is only advanced by the caller once decryption succeeds.
+        """
+        _NONCE_COUNTER.pack_into(self.nonce_buf, 4, self.recv_nonce)
+        return bytes(self.nonce_buf)
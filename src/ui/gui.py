@@ -5,13 +5,122 @@ TUI-styled GUI for DNIe Instant Messenger.
 FIXED: Proper message color coding for sent/received/queued.
 """
 
+import asyncio
+import logging
+import re
 import tkinter as tk
+import _tkinter
+from collections import deque
 from tkinter import font as tkfont
-from typing import List, Callable, Optional
+from typing import Deque, Dict, List, Callable, Optional, Tuple
 from datetime import datetime
 
 from session.session import Peer
 
+# Debug traces are enabled with the "dnie" logger (DNIE_DEBUG=1 in main_gui)
+logger = logging.getLogger("dnie.gui")
+
+# Most messages kept in the chat Text widget; older ones are held as
+# pre-rendered fragments and re-inserted when the user scrolls to the top
+CHAT_WINDOW = 200
+# Messages re-inserted per scroll-to-top
+HYDRATE_BUFFER = 40
+# Scroll position (fraction from the top) that triggers re-insertion
+HYDRATE_THRESHOLD = 0.1
+
+# Tk event processing period when driven from asyncio (~60 Hz)
+GUI_FRAME_INTERVAL = 1 / 60
+# Longer period used while Tk has had nothing to do (idle window)
+GUI_IDLE_INTERVAL = 0.1
+
+# Lines for the chat and system areas are buffered and written together
+# at most this often (one see(END) per flush)
+FLUSH_INTERVAL_MS = 50
+
+# Lines kept in the system log; older ones are deleted from the top
+SYSTEM_LOG_LINES = 1000
+
+# Message types/senders rendered as system lines
+_SYSTEM_TYPES = frozenset({"disconnect", "connect", "system"})
+# System types also shown in the chat of the selected peer
+_PRESENCE_TYPES = frozenset({"disconnect", "connect"})
+_SYSTEM_SENDERS = frozenset({"System", "system"})
+
+# append_chat lines starting with these go to the system log
+# (str.startswith takes the whole tuple in one call)
+_SYSTEM_EMOJI_PREFIXES = ("🚀", "👤", "🔑", "📡", "🔍", "🤝", "🔐", "📝", "✅")
+_WARN_PREFIXES = ("⚠", "❌", "📬")
+
+# append_system tag by marker found in the text; one group per tag, and
+# the lowest group found anywhere in the text wins
+_SYSTEM_TAG_RE = re.compile("(❌|Error)|(⚠)|(✅|🤝|🔐|👋)")
+_SYSTEM_TAG_NAMES = ("error", "warning", "success")
+# Emojis stripped from system messages shown in the status bar
+_STATUS_STRIP = str.maketrans("", "", "🚀📡🔍🤝⚠✅👋")
+
+# Chat header for the selected peer, "─"-padded to 80 columns
+_CHAT_HEADER_PREFIX = "┌─ 💬 CHAT CON "
+_CHAT_HEADER_FMT = _CHAT_HEADER_PREFIX + "{:─<%d}┐" % (80 - len(_CHAT_HEADER_PREFIX))
+
+# Peers list row: marker, name (cut to 12), short peer id, address
+_PEER_ROW_FMT = "{} {:<12.12} │ {:<11} │ {}"
+
+# Rendering style -> (prefix format taking the sender, tag, text ending, extra fragment)
+_MESSAGE_STYLES: Dict[str, Tuple[str, str, str, Optional[Tuple[str, str]]]] = {
+    "queued": ("► {}: ", "queued", " ", ("[📬 Encolado]\n", "warning")),
+    "user": ("► {}: ", "user", "\n", None),
+    "system": ("● ", "system", "\n", None),
+    "peer": ("◄ {}: ", "peer", "\n", None),
+}
+
+Segments = List[Tuple[str, str]]
+
+# Text widgets stay in state NORMAL (no per-insert state toggles); this
+# bind tag, placed before the Text class tag, swallows anything that would
+# edit them. The toplevel tag goes first so window shortcuts still fire.
+_READ_ONLY_TAG = "ReadOnlyText"
+_READ_ONLY_EVENTS = ("<Button-2>", "<<Paste>>", "<<Cut>>", "<<Clear>>",
+                     "<<PasteSelection>>", "<<Undo>>", "<<Redo>>")
+# Keys let through to the Text class: scrolling, cursor movement and copy
+_READ_ONLY_KEYS = frozenset({
+    "Left", "Right", "Up", "Down", "Home", "End", "Prior", "Next",
+    "Shift_L", "Shift_R", "Control_L", "Control_R", "Alt_L", "Alt_R",
+})
+_READ_ONLY_CONTROL_KEYS = frozenset({"c", "a", "slash", "backslash"})
+_CONTROL_MASK = 0x4
+
+
+def _line_count(segments: Segments) -> int:
+    """Number of text lines a message's fragments occupy."""
+    return sum(fragment.count("\n") for fragment, _ in segments)
+
+
+def _insert_args(messages: Tuple[Segments, ...]) -> List[str]:
+    """
+    Flatten messages into Text.insert's alternating text/tag arguments,
+    so a whole batch goes to Tk in one command.
+    """
+    return [part for segments in messages for fragment_tag in segments for part in fragment_tag]
+
+
+def _read_only_key(event) -> Optional[str]:
+    """Block key presses that would edit a read-only Text widget."""
+    if event.keysym in _READ_ONLY_KEYS:
+        return None
+    if event.state & _CONTROL_MASK and event.keysym in _READ_ONLY_CONTROL_KEYS:
+        return None
+    return "break"
+
+
+def _make_read_only(text: tk.Text):
+    """Make a NORMAL-state Text widget read-only for the user."""
+    # NORMAL state keeps a blinking insert cursor; hide it, nothing can be typed here
+    text.config(insertwidth=0, insertontime=0)
+    text.bind_class(_READ_ONLY_TAG, "<Key>", _read_only_key)
+    for sequence in _READ_ONLY_EVENTS:
+        text.bind_class(_READ_ONLY_TAG, sequence, lambda e: "break")
+    text.bindtags((str(text), str(text.winfo_toplevel()), _READ_ONLY_TAG, "Text", "all"))
+
 
 class ChatGUI:
     """
@@ -45,9 +154,36 @@ class ChatGUI:
         # Data
         self.peers: List[Peer] = []
         self.current_peer_index: int = -1
+        # Memoized shortened peer IDs for the peers list (peer_id -> display text)
+        self._short_ids: Dict[str, str] = {}
+        # Rows currently in peers_listbox, and which of them is selected
+        self._displayed_rows: List[str] = []
+        self._selected_row: Optional[int] = None
+        # Rendered history per peer_id: (message count, last message, [(text, tag)])
+        self._render_cache: Dict[str, Tuple[int, dict, List[Segments]]] = {}
+        # Incremented per history load; stale background loads are discarded
+        self._history_request = 0
+        # Sliding window over the chat area: fragments of each message shown,
+        # and of the evicted messages above and below it (all oldest first)
+        self._window: Deque[Segments] = deque()
+        self._older: List[Segments] = []
+        self._newer: List[Segments] = []
+
+        # Lines waiting for the next flush: (peer identity, fragments) for the
+        # chat area, (timestamp, text, tag) for the system log
+        self._pending_chat: List[Tuple[Optional[str], Segments]] = []
+        self._pending_system: List[Tuple[str, str, str]] = []
+        self._chat_flush_scheduled = False
+        self._system_flush_scheduled = False
+        # Last system log entries, to refill the log if its window is rebuilt,
+        # and the number of lines currently in system_text
+        self._system_log: Deque[Tuple[str, str, str]] = deque(maxlen=SYSTEM_LOG_LINES)
+        self._system_line_count = 0
 
         # Store current username
         self.username = "Tú"
+        # Senders displayed as our own messages (rebuilt by set_username)
+        self._our_senders = frozenset({"Tú", self.username})
 
         # Integrated chat history manager
         self.chat_history_manager = chat_history_manager
@@ -62,14 +198,17 @@ class ChatGUI:
 
         self._create_widgets()
 
-        self.system_window = None
+        # Built once and only ever withdrawn/deiconified, so logging never
+        # constructs widgets
+        self._create_system_window()
+        self.system_window.withdraw()
 
         # Proper window close protocol
         self.root.protocol("WM_DELETE_WINDOW", self._request_close)
 
     def _request_close(self):
         """Handle window close request."""
-        print("[DEBUG] Close requested, setting close_requested flag to True")
+        logger.debug("Close requested, setting close_requested flag to True")
         self.close_requested = True
         self.is_closing = True
 
@@ -178,13 +317,13 @@ class ChatGUI:
             font=self.text_font,
             bg=self.bg_color,
             fg=self.fg_color,
-            yscrollcommand=messages_scroll.set,
+            yscrollcommand=lambda first, last: self._on_messages_scroll(messages_scroll, first, last),
             insertbackground=self.fg_color,
             selectbackground=self.select_bg,
             highlightthickness=0,
-            borderwidth=0,
-            state=tk.DISABLED
+            borderwidth=0
         )
+        _make_read_only(self.messages_text)
         self.messages_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         messages_scroll.config(command=self.messages_text.yview)
 
@@ -230,9 +369,10 @@ class ChatGUI:
         )
         send_label.pack(side=tk.RIGHT, padx=5)
 
+        self._last_status = "└─ Estado: Iniciando..."
         self.status_bar = tk.Label(
             main_frame,
-            text="└─ Estado: Iniciando...",
+            text=self._last_status,
             bg=self.border_color,
             fg=self.system_color,
             font=self.small_font,
@@ -248,7 +388,8 @@ class ChatGUI:
     def set_username(self, username: str):
         """Set the current username for message detection."""
         self.username = username
-        print(f"[DEBUG] GUI username set to: {username}")
+        self._our_senders = frozenset({"Tú", username})
+        logger.debug("GUI username set to: %s", username)
 
     def _create_system_window(self):
         """Create the system messages window with terminal styling."""
@@ -282,9 +423,9 @@ class ChatGUI:
             yscrollcommand=scroll.set,
             selectbackground=self.select_bg,
             highlightthickness=0,
-            borderwidth=0,
-            state=tk.DISABLED
+            borderwidth=0
         )
+        _make_read_only(self.system_text)
         self.system_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scroll.config(command=self.system_text.yview)
 
@@ -294,6 +435,10 @@ class ChatGUI:
         self.system_text.tag_config("error", foreground=self.error_color)
         self.system_text.tag_config("timestamp", foreground="#808080")
 
+        # A rebuilt window starts with the entries still in memory
+        self._system_line_count = 0
+        self._insert_system(self._system_log)
+
         footer = tk.Label(
             self.system_window,
             text="[Ctrl+C]=Clear  [Esc]=Close",
@@ -309,23 +454,27 @@ class ChatGUI:
 
     def _show_system_window(self):
         """Show the system messages window."""
-        if self.system_window is None or not self.system_window.winfo_exists():
+        try:
+            self.system_window.deiconify()
+        except tk.TclError:
+            # Destroyed behind our back: build it again
             self._create_system_window()
-        self.system_window.deiconify()
+            self.system_window.deiconify()
         self.system_window.lift()
 
     def _hide_system_window(self):
         """Hide the system messages window."""
-        if self.system_window and self.system_window.winfo_exists():
+        try:
             self.system_window.withdraw()
+        except tk.TclError:
+            pass
 
     def _clear_system_messages(self):
         """Clear system messages."""
-        if self.system_text:
-            self.system_text.config(state=tk.NORMAL)
-            self.system_text.delete(1.0, tk.END)
-            self.system_text.insert(1.0, "System log cleared.\n", "info")
-            self.system_text.config(state=tk.DISABLED)
+        self.system_text.delete(1.0, tk.END)
+        self.system_text.insert(1.0, "System log cleared.\n", "info")
+        self._system_log.clear()
+        self._system_line_count = 1
 
     def _on_peer_selected(self, event):
         """Handle peer selection - load encrypted chat history."""
@@ -340,9 +489,9 @@ class ChatGUI:
 
         peer = self.peers[self.current_peer_index]
 
-        header_text = f"┌─ 💬 CHAT CON {peer.name.upper()} ({peer.peer_id or 'unknown'}) "
-        header_text += "─" * (80 - len(header_text)) + "┐"
-        self.chat_header.config(text=header_text)
+        self.chat_header.config(
+            text=_CHAT_HEADER_FMT.format(f"{peer.name.upper()} ({peer.peer_id or 'unknown'}) ")
+        )
 
         # LOAD ENCRYPTED HISTORY
         self._load_chat_history(peer)
@@ -351,86 +500,244 @@ class ChatGUI:
         self.input_entry.focus()
 
     def _load_chat_history(self, peer: Peer):
-        """Load and display encrypted chat history for a peer."""
-        peer_id = peer.peer_id or f"{peer.address}:{peer.port}"
-
-        self.messages_text.config(state=tk.NORMAL)
-        self.messages_text.delete(1.0, tk.END)
+        """
+        Load and display encrypted chat history for a peer.
+        When running under asyncio the decrypting read happens in a worker
+        thread; a placeholder is shown until _render_history replaces it.
+        """
+        peer_id = peer.identity
+        self._history_request += 1
+        request = self._history_request
+
+        if not self.chat_history_manager:
+            self._render_history(request, peer_id, None, None)
+            return
 
-        # LOAD FROM ENCRYPTED STORAGE
-        if self.chat_history_manager:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # Plain Tk mainloop (run()): read synchronously
             try:
                 messages = self.chat_history_manager.get_messages(peer_id, limit=100)
+            except Exception as e:
+                self._render_history(request, peer_id, None, e)
+            else:
+                self._render_history(request, peer_id, messages, None)
+            return
 
-                if messages:
-                    for msg in messages:
-                        sender = msg.get('sender', 'Unknown')
-                        text = msg.get('text', '')
-                        timestamp = msg.get('timestamp', '')
-                        msg_type = msg.get('type', 'user')
+        self._clear_chat_area()
+        self._insert_segments([("Cargando historial...\n", "system")])
 
-                        # Check if this is our message
-                        if msg_type in ["user", "queued"]:
-                            sender = "Tú"
+        future = asyncio.ensure_future(
+            asyncio.to_thread(self.chat_history_manager.get_messages, peer_id, 100)
+        )
 
-                        self._display_message(sender, text, timestamp, msg_type)
-                else:
-                    self.messages_text.insert(tk.END, "No hay mensajes previos con este peer.\n", "system")
-            except Exception as e:
-                self.messages_text.insert(tk.END, f"Error cargando historial: {e}\n", "error")
-                print(f"[ERROR] Loading history: {e}")
+        def done(f: asyncio.Future):
+            error = f.exception()
+            messages = None if error else f.result()
+            self.root.after_idle(self._render_history, request, peer_id, messages, error)
+
+        future.add_done_callback(done)
+
+    def _clear_chat_area(self):
+        """Empty the chat area and its window state."""
+        self.messages_text.delete(1.0, tk.END)
+        self._window.clear()
+        self._older = []
+        self._newer = []
+        # The history is authoritative; drop lines not yet flushed
+        self._pending_chat.clear()
+
+    def _render_history(self, request: int, peer_id: str, messages: Optional[List[dict]],
+                        error: Optional[BaseException]):
+        """Show a loaded history, unless another peer was selected meanwhile."""
+        if request != self._history_request or self.is_closing:
+            return
+
+        self._clear_chat_area()
+
+        if error is not None:
+            self._insert_segments([(f"Error cargando historial: {error}\n", "error")])
+            logger.error("Loading history: %s", error)
+        elif not self.chat_history_manager:
+            self._insert_segments([("Historial de chat no disponible.\n", "system")])
+        elif messages:
+            rendered = self._history_segments(peer_id, messages)
+            self._older = rendered[:-CHAT_WINDOW]
+            self._insert_segments(*rendered[-CHAT_WINDOW:])
         else:
-            self.messages_text.insert(tk.END, "Historial de chat no disponible.\n", "system")
+            self._insert_segments([("No hay mensajes previos con este peer.\n", "system")])
 
-        self.messages_text.config(state=tk.DISABLED)
         self.messages_text.see(tk.END)
 
-    def _display_message(self, sender: str, text: str, timestamp: str = "", msg_type: str = "user"):
-        """Display a message in the chat area with appropriate color."""
-        # Don't change state if already enabled
-        was_disabled = str(self.messages_text.cget("state")) == "disabled"
-        if was_disabled:
-            self.messages_text.config(state=tk.NORMAL)
+    def _insert_segments(self, *messages: Segments):
+        """
+        Insert messages' fragments at the end of the chat area in one Tk
+        call, evicting the oldest messages past CHAT_WINDOW.
+        """
+        if not messages:
+            return
+        if len(messages) >= CHAT_WINDOW:
+            # The batch alone fills the window: replace it instead of
+            # inserting everything and evicting most of it again
+            self._older.extend(self._window)
+            self._older.extend(messages[:-CHAT_WINDOW])
+            self._window.clear()
+            self.messages_text.delete("1.0", tk.END)
+            messages = messages[-CHAT_WINDOW:]
+        self.messages_text.insert(tk.END, *_insert_args(messages))
+        self._window.extend(messages)
+
+        evicted_lines = 0
+        while len(self._window) > CHAT_WINDOW:
+            evicted = self._window.popleft()
+            self._older.append(evicted)
+            evicted_lines += _line_count(evicted)
+        if evicted_lines:
+            self.messages_text.delete("1.0", f"{evicted_lines + 1}.0")
+
+    def _on_messages_scroll(self, scrollbar: tk.Scrollbar, first: str, last: str):
+        """
+        Chat area scrolled: update the scrollbar, re-insert evicted messages
+        near the top or the bottom.
+        """
+        scrollbar.set(first, last)
+        if self._older and float(first) < HYDRATE_THRESHOLD:
+            self.root.after_idle(self._hydrate_older)
+        elif self._newer and float(last) > 1 - HYDRATE_THRESHOLD:
+            self.root.after_idle(self._hydrate_newer)
+
+    def _hydrate_older(self):
+        """
+        Re-insert up to HYDRATE_BUFFER evicted messages above the window,
+        moving as many off its bottom so it stays at CHAT_WINDOW.
+        """
+        if not self._older:
+            return
+        batch = self._older[-HYDRATE_BUFFER:]
+        del self._older[-HYDRATE_BUFFER:]
+
+        self.messages_text.insert("1.0", *_insert_args(batch))
+        self._window.extendleft(reversed(batch))
+        added = sum(_line_count(segments) for segments in batch)
+
+        trimmed = []
+        while len(self._window) > CHAT_WINDOW:
+            trimmed.append(self._window.pop())
+        if trimmed:
+            trimmed.reverse()
+            self._newer[:0] = trimmed
+            kept_lines = sum(_line_count(segments) for segments in self._window)
+            self.messages_text.delete(f"{kept_lines + 1}.0", tk.END)
+
+        # Keep the same text in view
+        self.messages_text.yview_scroll(added, "units")
+
+    def _hydrate_newer(self):
+        """Re-insert up to HYDRATE_BUFFER messages moved off the bottom of the window."""
+        if not self._newer:
+            return
+        batch = self._newer[:HYDRATE_BUFFER]
+        del self._newer[:HYDRATE_BUFFER]
+        self._insert_segments(*batch)
+
+    def _history_segments(self, peer_id: str, messages: List[dict]) -> List[Segments]:
+        """
+        Rendered (text, tag) fragments of each message in a peer's history,
+        reused while the history is unchanged (same length and same last
+        message object).
+        """
+        cached = self._render_cache.get(peer_id)
+        if cached and cached[0] == len(messages) and cached[1] is messages[-1]:
+            return cached[2]
+
+        rendered: List[Segments] = []
+        for msg in messages:
+            sender = msg.get('sender', 'Unknown')
+            msg_type = msg.get('type', 'user')
+
+            # Check if this is our message
+            if msg_type in ["user", "queued"]:
+                sender = "Tú"
+
+            rendered.append(self._message_segments(
+                sender, msg.get('text', ''), msg.get('timestamp', ''), msg_type
+            ))
+
+        self._render_cache[peer_id] = (len(messages), messages[-1], rendered)
+        return rendered
+
+    def _invalidate_peer_cache(self, peer_id: Optional[str]):
+        """Drop the rendered history of a peer (a new message was shown for it)."""
+        if peer_id:
+            self._render_cache.pop(peer_id, None)
+
+    def _message_segments(self, sender: str, text: str, timestamp: str = "",
+                          msg_type: str = "user") -> List[Tuple[str, str]]:
+        """Build the (text, tag) fragments that display one message."""
+        segments: List[Tuple[str, str]] = []
 
         if timestamp:
-            # Format timestamp if it's ISO format
-            try:
-                if 'T' in timestamp:
-                    dt = datetime.fromisoformat(timestamp)
-                    timestamp = dt.strftime("%H:%M:%S")
-            except:
-                pass
-            self.messages_text.insert(tk.END, f"[{timestamp}] ", "timestamp")
-
-        print(f"[DEBUG GUI] _display_message: sender='{sender}', type='{msg_type}'")
-
-        # FIXED: Better message type detection and coloring
-        if sender == "Tú" or sender == self.username or sender.lower() == "you":
-            # Our message
-            if msg_type == "queued":
-                # Queued message - BLUE
-                self.messages_text.insert(tk.END, f"► {sender}: ", "queued")
-                self.messages_text.insert(tk.END, f"{text} ", "queued")
-                self.messages_text.insert(tk.END, "[📬 Encolado]\n", "warning")
-                print(f"[DEBUG GUI] Displayed as QUEUED (blue)")
-            else:
-                # Sent message - CYAN
-                self.messages_text.insert(tk.END, f"► {sender}: ", "user")
-                self.messages_text.insert(tk.END, f"{text}\n", "user")
-                print(f"[DEBUG GUI] Displayed as USER (cyan)")
-        elif sender == "System" or sender == "system" or msg_type in ["disconnect", "connect", "system"]:
-            # System message - GREEN
-            self.messages_text.insert(tk.END, f"● {text}\n", "system")
-            print(f"[DEBUG GUI] Displayed as SYSTEM (green)")
+            # Format timestamp if it's ISO format ("YYYY-MM-DDTHH:MM:SS...");
+            # the time is at a fixed offset, no need to parse it
+            if len(timestamp) >= 19 and timestamp[10] == 'T':
+                timestamp = timestamp[11:19]
+            elif 'T' in timestamp:
+                try:
+                    timestamp = datetime.fromisoformat(timestamp).strftime("%H:%M:%S")
+                except:
+                    pass
+            segments.append((f"[{timestamp}] ", "timestamp"))
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("_display_message: sender=%r, type=%r", sender, msg_type)
+
+        # Our messages: QUEUED (blue) or USER (cyan); then SYSTEM (green), else PEER (orange)
+        if sender in self._our_senders or sender.lower() == "you":
+            style = "queued" if msg_type == "queued" else "user"
+        elif sender in _SYSTEM_SENDERS or msg_type in _SYSTEM_TYPES:
+            style = "system"
         else:
-            # Peer message - ORANGE
-            self.messages_text.insert(tk.END, f"◄ {sender}: ", "peer")
-            self.messages_text.insert(tk.END, f"{text}\n", "peer")
-            print(f"[DEBUG GUI] Displayed as PEER (orange)")
-
-        # Restore state only if it was disabled
-        if was_disabled:
-            self.messages_text.config(state=tk.DISABLED)
+            style = "peer"
+
+        prefix, tag, end, extra = _MESSAGE_STYLES[style]
+        segments.append((prefix.format(sender), tag))
+        segments.append((text + end, tag))
+        if extra:
+            segments.append(extra)
+
+        return segments
+
+    def _display_message(self, sender: str, text: str, timestamp: str = "", msg_type: str = "user"):
+        """Queue a message for the chat area (written on the next flush)."""
+        current_peer = self.get_current_peer()
+        self._pending_chat.append((
+            current_peer.identity if current_peer else None,
+            self._message_segments(sender, text, timestamp, msg_type),
+        ))
+        if not self._chat_flush_scheduled:
+            self._chat_flush_scheduled = True
+            self.root.after(FLUSH_INTERVAL_MS, self._flush_chat)
+
+    def _flush_chat(self):
+        """Write all queued chat lines still meant for the current peer."""
+        self._chat_flush_scheduled = False
+        pending, self._pending_chat = self._pending_chat, []
+        if self.is_closing:
+            return
+
+        current_peer = self.get_current_peer()
+        current_id = current_peer.identity if current_peer else None
+        batch = [segments for peer_id, segments in pending if peer_id == current_id]
+        if not batch:
+            return
+
+        if self._newer:
+            # Scrolled back through the history: new lines go after the
+            # messages moved off the bottom
+            batch[:0] = self._newer
+            self._newer = []
+        self._insert_segments(*batch)
         self.messages_text.see(tk.END)
 
     def _on_send_message(self, event):
@@ -464,42 +771,37 @@ class ChatGUI:
         if self.is_closing:
             return
 
-        print(f"[DEBUG GUI] append_chat: text='{text}', type='{msg_type}'")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("append_chat: text=%r, type=%r", text, msg_type)
 
         # System messages go to system log
-        is_system_msg = (msg_type in ["disconnect", "connect", "system"] or
-                        any(text.startswith(emoji) for emoji in 
-                            ["🚀", "👤", "🔑", "📡", "🔍", "🤝", "🔐", "📝", "✅"]))
+        is_system_msg = msg_type in _SYSTEM_TYPES or text.startswith(_SYSTEM_EMOJI_PREFIXES)
 
         # Warning/error messages
-        is_warning_or_error = text.startswith("⚠") or text.startswith("❌") or text.startswith("📬")
+        is_warning_or_error = text.startswith(_WARN_PREFIXES)
 
         if is_system_msg or is_warning_or_error:
             # Log to system window
             self.append_system(text)
 
             # ALSO show disconnect/connect in chat if applicable
-            if msg_type in ["disconnect", "connect"]:
+            if msg_type in _PRESENCE_TYPES:
                 current_peer = self.get_current_peer()
                 if current_peer and self.current_peer_index >= 0:
                     self._display_message("System", text, datetime.now().strftime("%H:%M:%S"), msg_type)
         else:
             # FIXED: Regular chat message - parse and display with correct type
-            if ": " in text:
-                # Format: [Sender]: Message or [Sender → Recipient]: Message
-                parts = text.split(": ", 1)
-                sender_part = parts[0].strip("[]")
-                message = parts[1]
-
+            # Format: [Sender]: Message or [Sender → Recipient]: Message
+            sender_part, sep, message = text.partition(": ")
+            if sep:
                 # Extract sender name (handle "Tú → PeerName" format)
-                if " → " in sender_part:
-                    sender = sender_part.split(" → ")[0]
-                else:
-                    sender = sender_part
+                sender = sender_part.strip("[]").partition(" → ")[0]
 
                 timestamp = datetime.now().strftime("%H:%M:%S")
 
-                print(f"[DEBUG GUI] Parsed: sender='{sender}', message='{message}', type={msg_type}")
+                if debug:
+                    logger.debug("Parsed: sender=%r, message=%r, type=%s", sender, message, msg_type)
 
                 # Display if peer is selected and message is from/to current peer
                 if self.current_peer_index >= 0:
@@ -508,83 +810,164 @@ class ChatGUI:
                     if current_peer and (sender == current_peer.name or 
                                         sender == "Tú" or 
                                         sender == self.username):
-                        print(f"[DEBUG GUI] Displaying with type: {msg_type}")
+                        if debug:
+                            logger.debug("Displaying with type: %s", msg_type)
+                        self._invalidate_peer_cache(current_peer.identity)
                         # PASS THE TYPE TO _display_message!
                         self._display_message(sender, message, timestamp, msg_type)
-                    else:
-                        print(f"[DEBUG GUI] Not displaying - wrong peer")
-                else:
-                    print(f"[DEBUG GUI] Not displaying - no peer selected")
-            else:
-                print(f"[DEBUG GUI] Unknown message format: {text}")
+                    elif debug:
+                        logger.debug("Not displaying - wrong peer")
+                elif debug:
+                    logger.debug("Not displaying - no peer selected")
+            elif debug:
+                logger.debug("Unknown message format: %s", text)
+
+    def append_chat_batch(self, entries: List[Tuple[str, str]]):
+        """Append several (text, msg_type) lines; Tk repaints once on the next update."""
+        if self.is_closing:
+            return
+        for text, msg_type in entries:
+            self.append_chat(text, msg_type)
+
+    def append_peer_message(self, sender: str, payload: str | bytes):
+        """
+        Display a message received from a peer (called by messenger).
+        Skips the format-then-parse round trip of append_chat; raw plaintext
+        bytes are decoded only if the message is actually rendered.
+        """
+        if self.is_closing:
+            return
+
+        current_peer = self.get_current_peer()
+        if not current_peer or sender != current_peer.name:
+            return
+
+        self._invalidate_peer_cache(current_peer.identity)
+
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8", errors="replace")
+
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        self._display_message(sender, payload, timestamp, "peer")
 
     def append_system(self, text: str, tag: str = "info"):
         """Append system message."""
         if self.is_closing:
             return
 
-        if "❌" in text or "Error" in text:
-            tag = "error"
-        elif "⚠" in text:
-            tag = "warning"
-        elif "✅" in text or "🤝" in text or "🔐" in text or "👋" in text:
-            tag = "success"
+        group = min((m.lastindex for m in _SYSTEM_TAG_RE.finditer(text)), default=0)
+        if group:
+            tag = _SYSTEM_TAG_NAMES[group - 1]
 
-        if self.system_window is None or not self.system_window.winfo_exists():
-            self._create_system_window()
-            self.system_window.withdraw()
+        self._pending_system.append((datetime.now().strftime("%H:%M:%S"), text, tag))
+        if not self._system_flush_scheduled:
+            self._system_flush_scheduled = True
+            self.root.after(FLUSH_INTERVAL_MS, self._flush_system)
 
         try:
-            self.system_text.config(state=tk.NORMAL)
-            timestamp = datetime.now().strftime("%H:%M:%S")
-            self.system_text.insert(tk.END, f"[{timestamp}] ", "timestamp")
-            self.system_text.insert(tk.END, f"{text}\n", tag)
-            self.system_text.config(state=tk.DISABLED)
-            self.system_text.see(tk.END)
+            clean_text = text.translate(_STATUS_STRIP).strip()
+            self._set_status(f"└─ {clean_text[:70]}...")
         except:
             pass
 
+    def _set_status(self, status: str):
+        """Show a status bar text, skipping the Tk call if it is already shown."""
+        if status != self._last_status:
+            self.status_bar.config(text=status)
+            self._last_status = status
+
+    def _flush_system(self):
+        """Write all queued system log lines."""
+        self._system_flush_scheduled = False
+        pending, self._pending_system = self._pending_system, []
+        if self.is_closing or not pending:
+            return
+
+        self._system_log.extend(pending)
         try:
-            clean_text = text.replace("🚀", "").replace("📡", "").replace("🔍", "").replace("🤝", "").replace("⚠", "").replace("✅", "").replace("👋", "").strip()
-            self.status_bar.config(text=f"└─ {clean_text[:70]}...")
+            self._insert_system(pending)
+            self.system_text.see(tk.END)
         except:
             pass
 
+    def _insert_system(self, entries):
+        """Insert (timestamp, text, tag) entries, trimming the log to SYSTEM_LOG_LINES."""
+        if not entries:
+            return
+        args = []
+        for timestamp, text, tag in entries:
+            args += (f"[{timestamp}] ", "timestamp", f"{text}\n", tag)
+            self._system_line_count += text.count("\n") + 1
+        self.system_text.insert(tk.END, *args)
+
+        if self._system_line_count > SYSTEM_LOG_LINES:
+            drop = self._system_line_count - SYSTEM_LOG_LINES
+            self.system_text.delete("1.0", f"{drop + 1}.0")
+            self._system_line_count -= drop
+
     def update_contacts(self, peers: List[Peer]):
         """Update the peers list."""
         if self.is_closing:
             return
 
-        self.peers = peers
-
+        # Track the selection by peer, not by row index
         current_peer = self.get_current_peer()
+        self.peers = peers
 
-        self.peers_listbox.delete(0, tk.END)
-
+        rows: List[str] = []
+        selected_row: Optional[int] = None
         for i, peer in enumerate(peers):
             is_selected = (current_peer and peer.peer_id == current_peer.peer_id)
-            marker = "👉" if is_selected else "  "
-
-            name = peer.name[:12] if len(peer.name) > 12 else peer.name
-            peer_id_short = (peer.peer_id[:8] + "...") if peer.peer_id and len(peer.peer_id) > 11 else (peer.peer_id or "unknown")
-
-            display = f"{marker} {name:<12} │ {peer_id_short:<11} │ {peer.address}"
-
-            self.peers_listbox.insert(tk.END, display)
+            rows.append(_PEER_ROW_FMT.format(
+                "👉" if is_selected else "  ", peer.name,
+                self._short_peer_id(peer.peer_id), peer.address
+            ))
 
             if is_selected:
-                self.peers_listbox.selection_set(i)
+                selected_row = i
                 self.current_peer_index = i
 
+        # Only touch rows whose text changed
+        old_rows = self._displayed_rows
+        common = min(len(old_rows), len(rows))
+        changed = False
+        for i in range(common):
+            if old_rows[i] != rows[i]:
+                self.peers_listbox.delete(i)
+                self.peers_listbox.insert(i, rows[i])
+                changed = True
+        if len(old_rows) > common:
+            self.peers_listbox.delete(common, tk.END)
+        elif len(rows) > common:
+            self.peers_listbox.insert(tk.END, *rows[common:])
+        self._displayed_rows = rows
+
+        # Re-select only if the selected row moved or was rewritten
+        if selected_row != self._selected_row or (changed and selected_row is not None):
+            self.peers_listbox.selection_clear(0, tk.END)
+            if selected_row is not None:
+                self.peers_listbox.selection_set(selected_row)
+        self._selected_row = selected_row
+
         peer_count = len(peers)
         try:
             if peer_count == 0:
-                self.status_bar.config(text="└─ Estado: No hay peers disponibles")
+                self._set_status("└─ Estado: No hay peers disponibles")
             else:
-                self.status_bar.config(text=f"└─ Estado: {peer_count} peer(s) detectado(s)")
+                self._set_status(f"└─ Estado: {peer_count} peer(s) detectado(s)")
         except:
             pass
 
+    def _short_peer_id(self, peer_id: Optional[str]) -> str:
+        """Return the abbreviated peer ID shown in the peers list (cached)."""
+        if not peer_id:
+            return "unknown"
+        short = self._short_ids.get(peer_id)
+        if short is None:
+            short = (peer_id[:8] + "...") if len(peer_id) > 11 else peer_id
+            self._short_ids[peer_id] = short
+        return short
+
     def get_current_peer(self) -> Optional[Peer]:
         """Return currently selected peer."""
         if self.current_peer_index < 0 or self.current_peer_index >= len(self.peers):
@@ -599,21 +982,20 @@ class ChatGUI:
             self._request_close()
 
     async def run_async(self):
-        """Run asynchronously."""
-        import asyncio
-
-        def update():
-            if not self.is_closing and not self.close_requested:
-                try:
-                    self.root.update()
-                    self.root.after(10, update)
-                except:
-                    self.close_requested = True
-
-        update()
-
-        try:
-            while not self.close_requested:
-                await asyncio.sleep(0.01)
-        except:
-            pass
+        """
+        Run the GUI on the asyncio event loop: drain all pending Tk events,
+        then sleep one frame (GUI_FRAME_INTERVAL), or GUI_IDLE_INTERVAL when
+        there was nothing to process. Returns once close is requested or the
+        window is destroyed.
+        """
+        flags = _tkinter.ALL_EVENTS | _tkinter.DONT_WAIT
+        while not self.close_requested:
+            busy = False
+            try:
+                while self.root.tk.dooneevent(flags):
+                    busy = True
+            except tk.TclError:
+                # Window destroyed
+                self.close_requested = True
+                break
+            await asyncio.sleep(GUI_FRAME_INTERVAL if busy else GUI_IDLE_INTERVAL)
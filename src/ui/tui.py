@@ -9,29 +9,72 @@ Layout:
 - Right bottom: input box to write messages.
 """
 
-from typing import List, Callable, Optional
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Callable, Optional, Tuple
 
 from prompt_toolkit import Application
+from prompt_toolkit.document import Document
 from prompt_toolkit.layout import Layout, HSplit, VSplit
 from prompt_toolkit.widgets import TextArea, Frame
 from prompt_toolkit.key_binding import KeyBindings
 
 from session.session import Peer
 
+_CHAT_BANNER = "=== DNIe Instant Messenger ==="
+
+# Lines kept in the chat area; older ones are dropped from the top
+CHAT_MAX_LINES = 2000
+# ...and at most this many characters, so a few huge lines can't grow it
+CHAT_MAX_CHARS = 512 * 1024
+
+# Peers panel fixed text, built once at import
+_HEADER = "📡 Peers Disponibles:\n"
+_NO_PEERS = "  (ningún peer detectado)\n"
+_SEP_EQ = "=" * 28 + "\n"
+_SEP_DASH = "-" * 28 + "\n"
+_MARK_SEL = "👉"
+_MARK_NONE = "  "
+# Index in ChatTUI._contact_parts of the first peer's marker
+_PEER_PARTS_START = 3
+
+# Chat and peers panel changes made within this many seconds are drawn
+# together, with a single invalidate (~30 fps)
+FLUSH_INTERVAL = 0.033
+
 
 class ChatTUI:
     """
     TUI for the DNIe instant messenger.
     """
 
-    def __init__(self):
-        # Current peers and selection state
-        self.peers: List[Peer] = []
+    def __init__(self, max_chat_lines: int = CHAT_MAX_LINES):
+        # Current peers (a snapshot, so callers mutating their list can't
+        # change it between draws) and selection state
+        self.peers: Tuple[Peer, ...] = ()
         self.current_peer_index: int = -1
+        # What the peers panel was last drawn from; unchanged -> no redraw
+        self._last_peers_key: Optional[tuple] = None
+        # Fragments of the drawn panel; peer i's selection marker is at
+        # _contact_parts[_PEER_PARTS_START + 2 * i]
+        self._contact_parts: List[str] = []
+        # Peer key (peer_id, name, address, port) -> its panel text after the
+        # marker; holds only the peers last drawn
+        self._peer_render_cache: Dict[tuple, str] = {}
+        # Peer count -> panel footer
+        self._footer_cache: Dict[int, str] = {}
+
+        # Chat lines (without their newline), kept apart from the TextArea so appends don't re-read
+        # and re-copy an ever-growing buffer string
+        self._chat_lines: Deque[str] = deque([_CHAT_BANNER], maxlen=max_chat_lines)
+        # Set when _chat_lines / _contact_parts hold changes not drawn yet
+        self._chat_dirty = False
+        self._contacts_dirty = False
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
 
         # Main chat area
         self.chat_area = TextArea(
-            text="=== DNIe Instant Messenger ===\n",
+            text=_CHAT_BANNER + "\n",
             multiline=True,
             read_only=True,
             scrollbar=True,
@@ -48,7 +91,7 @@ class ChatTUI:
 
         # Peers list
         self.contacts_area = TextArea(
-            text="📡 Peers:\n" + "-" * 28 + "\n",
+            text="📡 Peers:\n" + _SEP_DASH,
             multiline=True,
             read_only=True,
             width=32,
@@ -79,7 +122,10 @@ class ChatTUI:
 
         @self.kb.add("c-l")
         def clear_screen(event):
-            self.chat_area.text = "=== DNIe Instant Messenger ===\n"
+            self._chat_lines.clear()
+            self._chat_lines.append(_CHAT_BANNER)
+            self._chat_dirty = True
+            self._schedule_flush()
 
         @self.kb.add("c-n")
         def next_peer(event):
@@ -118,15 +164,74 @@ class ChatTUI:
 
     # ---------- Helpers ----------
 
-    def append_chat(self, text: str):
+    def append_chat(self, text: str | bytes, msg_type: str = "user"):
         """Append text to chat area and scroll."""
-        # FIXED: Simplified concatenation
-        self.chat_area.text += text + '\n'
-        self.chat_area.buffer.cursor_position = len(self.chat_area.text)
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", errors="replace")
+        self._chat_lines.append(text.rstrip("\n"))
+        self._chat_dirty = True
+        self._schedule_flush()
+
+    def append_chat_batch(self, entries: List[Tuple[str, str]]):
+        """Append several (text, msg_type) lines with a single buffer update."""
+        if not entries:
+            return
+        self._chat_lines.extend(text.rstrip("\n") for text, _ in entries)
+        self._chat_dirty = True
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Draw the dirty panels within FLUSH_INTERVAL."""
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (not running yet): draw right away
+            self._flush()
+            return
+        self._flush_handle = loop.call_later(FLUSH_INTERVAL, self._flush)
+
+    def _flush(self):
+        """Write the dirty panels' text and redraw once."""
+        self._flush_handle = None
+        if not (self._chat_dirty or self._contacts_dirty):
+            return
+
+        if self._contacts_dirty:
+            self._contacts_dirty = False
+            self.contacts_area.text = "".join(self._contact_parts)
+
+        if self._chat_dirty:
+            self._chat_dirty = False
+            self._flush_chat()
+
+        self.app.invalidate()
+
+    def _flush_chat(self):
+        """Show the kept chat lines, scrolled to the end."""
+        text = "\n".join(self._chat_lines) + "\n"
+        if len(text) > CHAT_MAX_CHARS:
+            excess = len(text) - CHAT_MAX_CHARS
+            while excess > 0 and len(self._chat_lines) > 1:
+                excess -= len(self._chat_lines.popleft()) + 1
+            text = "\n".join(self._chat_lines) + "\n"
+
+        # One document swap sets text and cursor (at the end) together
+        self.chat_area.buffer.set_document(Document(text), bypass_readonly=True)
+
+    def append_peer_message(self, sender: str, payload: str | bytes):
+        """
+        Append a message received from a peer.
+        Raw plaintext bytes are decoded only here, when the line is drawn.
+        """
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8", errors="replace")
+        self.append_chat(f"[{sender} → Tú]: {payload}", msg_type="peer")
 
     def update_contacts(self, peers: List[Peer]):
         """Update peers list in the left panel."""
-        self.peers = peers
+        self.peers = tuple(peers)
 
         if self.peers:
             if self.current_peer_index < 0 or self.current_peer_index >= len(self.peers):
@@ -134,22 +239,43 @@ class ChatTUI:
         else:
             self.current_peer_index = -1
 
-        contact_text = "📡 Peers Disponibles:\n"
-        contact_text += "=" * 28 + "\n\n"
+        # Heartbeats call this every tick; skip the relayout if nothing shown changed
+        peer_keys = tuple((p.peer_id, p.name, p.address, p.port) for p in self.peers)
+        key = (self.current_peer_index, peer_keys)
+        if key == self._last_peers_key:
+            return
+        self._last_peers_key = key
+
+        parts = [_HEADER, _SEP_EQ, "\n"]
 
+        old_cache = self._peer_render_cache
+        cache: Dict[tuple, str] = {}
         if not self.peers:
-            contact_text += "  (ningún peer detectado)\n"
+            parts.append(_NO_PEERS)
         else:
-            for idx, p in enumerate(self.peers):
-                marker = "👉" if idx == self.current_peer_index else "  "
-                contact_text += f"{marker} {p.name}\n"
-                contact_text += f"   ID: {p.peer_id or 'unknown'}\n"
-                contact_text += f"   📍 {p.address}:{p.port}\n\n"
-
-        contact_text += "-" * 28 + "\n"
-        contact_text += f"Total: {len(self.peers)} peer(s)\n"
-
-        self.contacts_area.text = contact_text
+            for idx, (p, peer_key) in enumerate(zip(self.peers, peer_keys)):
+                body = old_cache.get(peer_key)
+                if body is None:
+                    body = (
+                        f" {p.name}\n"
+                        f"   ID: {p.peer_id or 'unknown'}\n"
+                        f"   📍 {p.label}\n\n"
+                    )
+                cache[peer_key] = body
+                parts.append(_MARK_SEL if idx == self.current_peer_index else _MARK_NONE)
+                parts.append(body)
+        # Rebuilt each draw so departed peers drop out
+        self._peer_render_cache = cache
+
+        count = len(self.peers)
+        footer = self._footer_cache.get(count)
+        if footer is None:
+            footer = self._footer_cache[count] = f"{_SEP_DASH}Total: {count} peer(s)\n"
+        parts.append(footer)
+
+        self._contact_parts = parts
+        self._contacts_dirty = True
+        self._schedule_flush()
 
     def select_next_peer(self):
         """Cycle to the next peer (Ctrl+N)."""
@@ -157,8 +283,20 @@ class ChatTUI:
             self.current_peer_index = -1
             return
 
-        self.current_peer_index = (self.current_peer_index + 1) % len(self.peers)
-        self.update_contacts(self.peers)
+        old_index = self.current_peer_index
+        self.current_peer_index = (old_index + 1) % len(self.peers)
+
+        drawn = self._last_peers_key
+        if drawn and drawn[0] == old_index:
+            # The panel was drawn from the self.peers snapshot: only the two markers move
+            parts = self._contact_parts
+            parts[_PEER_PARTS_START + 2 * old_index] = _MARK_NONE
+            parts[_PEER_PARTS_START + 2 * self.current_peer_index] = _MARK_SEL
+            self._last_peers_key = (self.current_peer_index, drawn[1])
+            self._contacts_dirty = True
+            self._schedule_flush()
+        else:
+            self.update_contacts(self.peers)
 
         current = self.get_current_peer()
         if current: